@@ -59,9 +59,34 @@ class SentenceRerankPrediction(DataObjectBase):
 
     sentence: str
     result: SentenceRerankDocumentsList
+    num_rescored: int
+    query_index: int  # position of the query in the request, as streamed results may come out of order
 
 @dataobject()
 class DocumentRerankPrediction(DataObjectBase):
     """The result of a similarity scores prediction."""
 
     results: List[SentenceRerankPrediction]
+
+@dataobject()
+class ColumnarRerankDocuments(DataObjectBase):
+    """The input documents of all queries as parallel columns. The documents of
+    query i are those from group_offsets[i] up to group_offsets[i + 1] (or to
+    the end). titles and scores may be left empty."""
+
+    texts: List[str]
+    titles: List[str]
+    docids: List[str]
+    scores: List[float]
+    group_offsets: List[int]
+
+@dataobject()
+class ColumnarRerankPrediction(DataObjectBase):
+    """The ranked documents of all queries as parallel columns: indices into the
+    request columns and their scores, best first. The results of query i start
+    at group_offsets[i], and its first num_rescored[i] results were rescored."""
+
+    indices: List[int]
+    scores: List[float]
+    group_offsets: List[int]
+    num_rescored: List[int]
@@ -12,4 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from .columnar_reranker import ColumnarRerank
 from .reranker import Rerank
+from .retriever import Retrieve
+from .streaming_reranker import StreamingRerank
@@ -0,0 +1,163 @@
+# Copyright The Caikit Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import alog
+from caikit.core import TaskBase, module, task
+from caikit.core.toolkit.errors import error_handler
+from caikit_template.data_model.document_rerank import ColumnarRerankDocuments, ColumnarRerankPrediction
+from caikit_template.modules.reranker import Rerank
+from caikit_template.toolkit.colbert.infra import telemetry
+
+import time
+from typing import List
+
+logger = alog.use_channel("<SMPL_BLK>")
+error = error_handler.get(logger)
+
+
+@task(
+    required_parameters={
+        "queries": List[str],
+        "documents": ColumnarRerankDocuments,
+    },
+    output_type=ColumnarRerankPrediction,
+)
+class ColumnarRerankTask(TaskBase):
+    pass
+
+@module(
+    "00110203-0405-0607-0809-0a0b02dd0e3f",
+    "ColumnarRerankerModule",
+    "0.0.1",
+    ColumnarRerankTask,
+)
+class ColumnarRerank(Rerank):
+    """Reranker taking and returning flat columns instead of nested documents.
+
+    The documents of all queries come as parallel lists of texts, titles and
+    docids delimited by group offsets, and the result is only indices into
+    those lists and scores. Nothing per document is built or copied back, which
+    keeps (de)serialization and object churn small for thousands of documents
+    per request. Loads and saves like Rerank.
+    """
+
+    def run(self, queries: List[str], documents: ColumnarRerankDocuments, *args, **kwargs) -> ColumnarRerankPrediction:
+        """Run inference on model.
+        Args:
+            queries: List[str]
+            documents: ColumnarRerankDocuments
+            max_num_documents: int
+                Optional
+            include_title: boolean
+                Optional
+            time_budget_ms: float
+                Optional. As for Rerank. Documents that were not rescored keep
+                their incoming score (0 when none was sent), as do documents
+                only prescreened by the cascade.
+        Returns:
+            ColumnarRerankPrediction
+        """
+
+        start = time.monotonic()
+
+        max_num_documents = (
+            kwargs["max_num_documents"]
+            if "max_num_documents" in kwargs
+            else self.max_num_documents
+        )
+
+        include_title = (
+            kwargs["include_title"]
+            if "include_title" in kwargs
+            else self.include_title
+        )
+
+        time_budget_ms = (
+            kwargs["time_budget_ms"]
+            if "time_budget_ms" in kwargs
+            else self.time_budget_ms
+        )
+
+        texts = documents.texts
+        num_documents = len(texts)
+        offsets = list(documents.group_offsets)
+
+        error.value_check("<SMPL70953172E>", all(0 <= begin <= end <= num_documents for begin, end in zip(offsets, offsets[1:] + [num_documents])),
+                          "group_offsets must be non-decreasing offsets into texts")
+        # texts before the first offset would belong to no query and be silently dropped
+        error.value_check("<SMPL70953176E>", not offsets or offsets[0] == 0,
+                          "group_offsets must start at 0, got {}", offsets[:1])
+        error.value_check("<SMPL70953175E>", len(offsets) == len(queries),
+                          "group_offsets must hold one offset per query, got {} for {} queries", len(offsets), len(queries))
+        for name in ("titles", "docids", "scores"):
+            error.value_check("<SMPL70953173E>", len(getattr(documents, name)) in (0, num_documents),
+                              "{} must be empty or as long as texts", name)
+
+        bounds = list(zip(offsets, offsets[1:] + [num_documents]))
+
+        titles = documents.titles if include_title else []
+        if titles:
+            text_groups = [[title + '\n\n' + text if title is not None and len(title.strip()) > 0 else text
+                            for title, text in zip(titles[begin:end], texts[begin:end])] for begin, end in bounds]
+        else:
+            text_groups = [texts[begin:end] for begin, end in bounds]
+
+        docids = documents.docids or [None] * num_documents
+        docid_groups = [docids[begin:end] for begin, end in bounds]
+
+        incoming_scores = documents.scores or [None] * num_documents
+
+        telemetry.observe_size("request_queries", len(queries))
+        telemetry.observe_size("request_documents", num_documents)
+
+        if telemetry.sampled():
+            logger.info("Columnar rerank request: %d queries, %d documents, queries=%s", len(queries), num_documents, queries)
+
+        with telemetry.timed("request"):
+            if time_budget_ms is not None:
+                self._check_time_budget()
+
+                deadline = start + time_budget_ms / 1000.0
+
+                ranked_groups = []
+                for query, (begin, end), group_texts in zip(queries, bounds, text_groups):
+                    incoming = incoming_scores[begin:end]
+                    ranked, scores, num_rescored = self._budgeted_rank(query, group_texts, incoming, deadline, include_title, max_num_documents)
+                    scores = scores[:len(ranked)] + [incoming[idx] or 0.0 for idx in ranked[len(scores):]]
+                    ranked_groups.append((begin, ranked, scores, num_rescored))
+            else:
+                all_scores, all_rescored = self._rescore(queries, docid_groups, text_groups, include_title)
+
+                ranked_groups = []
+                for (begin, _), scores, rescored in zip(bounds, all_scores, all_rescored):
+                    scores = scores.tolist()
+                    ranked, num_rescored = self._rank(scores, max_num_documents, rescored)
+                    scores = [scores[idx] if rescored is None or rescored[idx] else incoming_scores[begin + idx] or 0.0
+                              for idx in ranked]
+                    ranked_groups.append((begin, ranked, scores, num_rescored))
+
+            with telemetry.timed("response"):
+                prediction = ColumnarRerankPrediction(indices=[], scores=[], group_offsets=[], num_rescored=[])
+                for begin, ranked, scores, num_rescored in ranked_groups:
+                    prediction.group_offsets.append(len(prediction.indices))
+                    prediction.indices.extend(begin + idx for idx in ranked)
+                    prediction.scores.extend(scores)
+                    prediction.num_rescored.append(num_rescored)
+
+                return prediction
+
+    @staticmethod
+    def _docids(docs: List[str]) -> List[str]:
+        # the groups already are docids
+        return docs
@@ -0,0 +1,127 @@
+# Copyright The Caikit Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import alog
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List
+
+from caikit_template.toolkit.colbert.infra import telemetry
+
+logger = alog.use_channel("<SMPL_BLK>")
+
+
+class _RerankWork:
+    def __init__(self, queries, text_groups, include_title, num_tokens):
+        self.queries = queries
+        self.text_groups = text_groups
+        self.include_title = include_title
+        self.num_tokens = num_tokens
+        self.arrival = time.monotonic()
+        self.future = Future()
+
+
+class RerankBatcher:
+    """Aggregates the rerank work of concurrent requests into shared encoder passes.
+
+    Callers block in `submit` while a single worker thread drains the queue. A batch
+    is closed once it holds `max_tokens` (estimated) tokens or once its oldest request
+    has waited `max_wait_ms`, whichever comes first. Each batch runs through one
+    `Searcher.rescore_batch` call and every caller gets back its own scores.
+    """
+
+    def __init__(self, searcher, max_wait_ms=5, max_tokens=16384):
+        self.searcher = searcher
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_tokens = max_tokens
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+
+        self._worker = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, queries: List[str], text_groups: List[List[str]], include_title=False):
+        """Queue the work of one request and wait for its per-group scores."""
+        num_tokens = self._estimate_tokens(queries, text_groups)
+        work = _RerankWork(queries, text_groups, include_title, num_tokens)
+
+        with self._condition:
+            self._queue.append(work)
+            self._condition.notify()
+
+        return work.future.result()
+
+    def _estimate_tokens(self, queries, text_groups):
+        # Whitespace words, capped at doc_maxlen, are a cheap stand-in for wordpieces
+        config = self.searcher.config
+        num_tokens = len(queries) * config.query_maxlen
+        for texts in text_groups:
+            num_tokens += sum(min(len(text.split()) + 3, config.doc_maxlen) for text in texts)
+
+        return num_tokens
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+
+            batch = [self._queue.popleft()]
+            num_tokens = batch[0].num_tokens
+            deadline = batch[0].arrival + self.max_wait
+
+            while num_tokens < self.max_tokens:
+                timeout = deadline - time.monotonic()
+                if not self._queue:
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                    continue
+
+                if num_tokens + self._queue[0].num_tokens > self.max_tokens:
+                    break
+
+                work = self._queue.popleft()
+                batch.append(work)
+                num_tokens += work.num_tokens
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+
+            for include_title in {work.include_title for work in batch}:
+                self._process([work for work in batch if work.include_title == include_title], include_title)
+
+    def _process(self, batch, include_title):
+        queries = [query for work in batch for query in work.queries]
+        text_groups = [texts for work in batch for texts in work.text_groups]
+
+        logger.debug("Micro-batch of %d requests, %d queries", len(batch), len(queries))
+        telemetry.observe_size("micro_batch_requests", len(batch))
+
+        try:
+            all_scores = self.searcher.rescore_batch(queries, text_groups, include_title=include_title)
+        except Exception as e:
+            for work in batch:
+                work.future.set_exception(e)
+            return
+
+        offset = 0
+        for work in batch:
+            work.future.set_result(all_scores[offset:offset + len(work.text_groups)])
+            offset += len(work.text_groups)
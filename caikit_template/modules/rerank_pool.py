@@ -0,0 +1,216 @@
+# Copyright The Caikit Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import alog
+import itertools
+import os
+import queue
+import threading
+import torch
+import torch.multiprocessing as mp
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import List
+
+logger = alog.use_channel("<SMPL_BLK>")
+
+# how often a replica waited on is checked for being alive
+_POLL_SECONDS = 1.0
+
+
+def _replica_main(checkpoint, config, cores, num_threads, requests, responses):
+    # Runs in a spawned process: pin it before torch sizes its thread pools
+    if cores:
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+
+    from caikit_template.toolkit.colbert.searcher import Searcher
+
+    try:
+        searcher = Searcher(None, checkpoint=checkpoint, collection=None, config=config, rescore_only=True)
+    except Exception as e:
+        responses.put((None, None, e))
+        return
+
+    responses.put((None, None, None))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+
+        request_id, queries, text_groups, include_title = request
+        try:
+            all_scores = searcher.rescore_batch(queries, text_groups, include_title=include_title)
+            responses.put((request_id, [scores.cpu().float().tolist() for scores in all_scores], None))
+        except Exception as e:
+            responses.put((request_id, None, e))
+
+
+class _Replica:
+    def __init__(self, context, checkpoint, config, cores, num_threads):
+        self.cores = cores
+        self.load = 0
+        self.futures = {}
+
+        self.requests = context.Queue()
+        self.responses = context.Queue()
+        self.process = context.Process(
+            target=_replica_main,
+            args=(checkpoint, config, cores, num_threads, self.requests, self.responses),
+            daemon=True,
+        )
+        self.process.start()
+
+
+class RerankPool:
+    """Serves rescoring from `num_replicas` worker processes, each holding its own Searcher.
+
+    Every replica is pinned to its own slice of the cores available to this
+    process and runs torch with that many intra-op threads, so concurrent
+    requests no longer oversubscribe one shared thread pool. Requests go to the
+    replica with the fewest outstanding requests.
+
+    A replica that dies fails its outstanding requests and stops receiving new
+    ones; a request not answered within `request_timeout_s` fails with a
+    TimeoutError.
+
+    Checkpoints saved by `Rerank.save` are memory-mapped, so the replicas share
+    one copy of the weights through the page cache; legacy `.dnn` checkpoints
+    are loaded by each replica separately.
+    """
+
+    def __init__(self, checkpoint, config, num_replicas, threads_per_replica=None, request_timeout_s=60.0):
+        self.checkpoint = checkpoint
+        self.config = config
+        self.request_timeout_s = request_timeout_s
+
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        chunk = len(cores) // num_replicas
+
+        if chunk == 0:
+            logger.warning("%d replicas for %d cores, leaving them unpinned", num_replicas, len(cores))
+
+        context = mp.get_context("spawn")
+
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._replicas = []
+        self._closed = False
+
+        for idx in range(num_replicas):
+            replica_cores = cores[idx * chunk:(idx + 1) * chunk] if chunk else []
+            num_threads = threads_per_replica or max(len(replica_cores), 1)
+            self._replicas.append(_Replica(context, checkpoint, config, replica_cores, num_threads))
+
+        # Fail at load time rather than on the first request
+        for replica in self._replicas:
+            try:
+                e = self._wait_ready(replica)
+            except RuntimeError as dead:
+                e = dead
+
+            if e is not None:
+                self.close()
+                raise e
+
+        for replica in self._replicas:
+            threading.Thread(target=self._collect, args=(replica,), name="rerank-pool", daemon=True).start()
+
+        logger.info("Started %d rerank replicas", num_replicas)
+
+    @staticmethod
+    def _wait_ready(replica):
+        while True:
+            try:
+                _, _, e = replica.responses.get(timeout=_POLL_SECONDS)
+                return e
+            except queue.Empty:
+                if not replica.process.is_alive():
+                    raise RuntimeError(f"Rerank replica exited with code {replica.process.exitcode} while loading")
+
+    def submit(self, queries: List[str], text_groups: List[List[str]], include_title=False):
+        """Run one request on the least loaded live replica and wait for its per-group scores."""
+        future = Future()
+
+        with self._lock:
+            if not self._replicas:
+                raise RuntimeError("No rerank replica is alive")
+
+            replica = min(self._replicas, key=lambda replica: replica.load)
+            request_id = next(self._ids)
+
+            replica.load += 1
+            replica.futures[request_id] = future
+
+        replica.requests.put((request_id, list(queries), text_groups, include_title))
+
+        try:
+            all_scores = future.result(timeout=self.request_timeout_s)
+        except FutureTimeoutError:
+            # the replica may still answer; its answer is then dropped
+            with self._lock:
+                replica.futures.pop(request_id, None)
+            raise
+
+        return [torch.tensor(scores) for scores in all_scores]
+
+    def _collect(self, replica):
+        while True:
+            try:
+                request_id, all_scores, e = replica.responses.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if replica.process.is_alive():
+                    continue
+
+                self._drop(replica)
+                return
+
+            with self._lock:
+                replica.load -= 1
+                future = replica.futures.pop(request_id, None)
+
+            if future is None:
+                continue  # timed out
+            elif e is not None:
+                future.set_exception(e)
+            else:
+                future.set_result(all_scores)
+
+    def _drop(self, replica):
+        """Stops routing to a dead replica and fails the requests it still had."""
+        with self._lock:
+            if replica in self._replicas:
+                self._replicas.remove(replica)
+            futures, replica.futures = replica.futures, {}
+
+            closed = self._closed
+            num_alive = len(self._replicas)
+
+        if not closed:
+            logger.error("Rerank replica exited with code %s, failing %d pending requests; %d replicas left",
+                         replica.process.exitcode, len(futures), num_alive)
+
+        for future in futures.values():
+            future.set_exception(RuntimeError(f"Rerank replica exited with code {replica.process.exitcode}"))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            replicas = list(self._replicas)
+
+        for replica in replicas:
+            replica.requests.put(None)
+
+        for replica in replicas:
+            replica.process.join(timeout=10)
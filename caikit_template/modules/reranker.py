@@ -17,12 +17,17 @@ from caikit.core import ModuleBase, ModuleConfig, ModuleSaver, TaskBase, module,
 from caikit.core.data_model import DataStream
 from caikit.core.toolkit.errors import error_handler
 from caikit_template.data_model.document_rerank import DocumentRerankPrediction, SentenceRerankPrediction, SentenceRerankDocumentsList, SentenceRerankDocuments, SentenceRerankDocument
+from caikit_template.modules.rerank_batcher import RerankBatcher
+from caikit_template.modules.rerank_pool import RerankPool
+from caikit_template.toolkit.colbert.infra import telemetry
 from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
 from caikit_template.toolkit.colbert.searcher import Searcher
 # from colbert.searcher import Searcher
 # from colbert.infra.config import ColBERTConfig
 
 import numpy as np
+import time
+import torch
 from typing import List, Dict, Union
 import os
 
@@ -58,11 +63,31 @@ class Rerank(ModuleBase):
         doc_maxlen=180,
         query_maxlen=32,
         include_title=False, 
-        max_num_documents=3
+        max_num_documents=3,
+        micro_batch_wait_ms=None,
+        micro_batch_max_tokens=16384,
+        docid_to_pid=None,
+        docids_are_pids=False,
+        pool=None,
+        time_budget_ms=None
     ) -> None:
         """Function to initialize the Reranker.
         This function gets called by `.load` and `.train` function
         which initializes this module.
+
+        Setting `micro_batch_wait_ms` enables micro-batching: the work of
+        concurrent `run` calls is aggregated into shared encoder passes of up
+        to `micro_batch_max_tokens` tokens, waiting at most that many ms.
+
+        When `model` was built over a PLAID index, documents whose docid maps
+        to a pid of that index (through `docid_to_pid`, or as the pid itself
+        when `docids_are_pids` is set) are scored from their stored embeddings
+        instead of being re-encoded.
+
+        When `pool` (a RerankPool) is given, rescoring runs on its worker
+        processes and `model` may be None.
+
+        `time_budget_ms` is the default latency budget of a request (see `run`).
         """
 
         super().__init__()
@@ -71,6 +96,23 @@ class Rerank(ModuleBase):
         self.query_maxlen = query_maxlen
         self.include_title = include_title
         self.max_num_documents = max_num_documents
+        self.docid_to_pid = docid_to_pid
+        self.docids_are_pids = docids_are_pids
+        self.pool = pool
+        self.time_budget_ms = time_budget_ms
+
+        self.batcher = None
+        if micro_batch_wait_ms is not None and pool is None:
+            # the batcher runs plain rescore_batch passes, which would silently bypass the cascade
+            error.value_check("<SMPL29604739E>", not model.config.cascade_keep,
+                              "cascade_keep is not supported with micro_batch_wait_ms")
+            # reranking from an index takes precedence in _rescore, so the batcher would never run
+            error.value_check("<SMPL29604740E>", model.rescore_only,
+                              "micro_batch_wait_ms is not supported with index_path")
+            self.batcher = RerankBatcher(model, max_wait_ms=micro_batch_wait_ms, max_tokens=micro_batch_max_tokens)
+
+        if time_budget_ms is not None:
+            self._check_time_budget()
 
     @classmethod
     def load(cls, model_path: str):
@@ -85,7 +127,9 @@ class Rerank(ModuleBase):
             return cls.bootstrap(model_path)
         else:
             config = ModuleConfig.load(model_path)
-            return cls.bootstrap(model_path)
+            if config.watbert_artifact_path:
+                return cls.bootstrap(os.path.join(model_path, config.watbert_artifact_path), **(config.colbert_config or {}))
+            return cls.bootstrap(model_path, **(config.colbert_config or {}))
 
 
     @classmethod
@@ -93,7 +137,24 @@ class Rerank(ModuleBase):
         """Load a non-caikit model
         Args:
             pretrained_model_name_or_path: str
-                Path to non-caikit model.
+                Path to non-caikit model: a directory holding `watbert.dnn.model`,
+                or a checkpoint directory as written by `save`.
+            **kwargs:
+                Optional ColBERTConfig settings for the Searcher, e.g. doc_cache_max_bytes,
+                query_cache_size and query_cache_ttl, quantize_int8 for an int8
+                dynamically quantized encoder on CPU or onnx_encoder_path for an
+                exported ONNX encoder, inference_precision ('fp32' or 'bf16') for
+                the autocast precision, and the module settings
+                micro_batch_wait_ms and micro_batch_max_tokens. Setting index_path
+                to a PLAID index built with this checkpoint enables reranking from
+                the index, with docid_map_path optionally naming a docid<TAB>pid file,
+                or docids_are_pids set when the docids are the pids of the index.
+                Setting num_replicas serves rescoring from that many worker processes,
+                each pinned to its share of the cores (threads_per_replica overrides
+                their torch thread count, replica_timeout_s how long a request waits
+                for its replica, 60 s by default). time_budget_ms sets the default latency
+                budget of a request. telemetry_sample_rate sets the fraction of
+                requests whose details are logged (default 0.01).
         """
 
         config = ColBERTConfig(
@@ -103,15 +164,47 @@ class Rerank(ModuleBase):
             doc_maxlen=180,
             query_maxlen = 32
         )
+        config.configure(**kwargs)
+
+        if "telemetry_sample_rate" in kwargs:
+            telemetry.set_sample_rate(kwargs["telemetry_sample_rate"])
+
+        checkpoint = os.path.join(pretrained_model_name_or_path, "watbert.dnn.model")
+        if not os.path.exists(checkpoint):
+            checkpoint = pretrained_model_name_or_path
+
+        if kwargs.get("num_replicas"):
+            error.value_check("<SMPL41590278E>", config.index_path is None,
+                              "num_replicas only supports rescoring, not reranking from an index")
+
+            # the replicas only run rescore_batch: settings of the other paths would be silently dropped,
+            # whether passed here or saved with the checkpoint, which the replicas merge under them
+            resolved = ColBERTConfig.from_existing(ColBERTConfig.load_from_checkpoint(checkpoint), config)
+            unsupported = [key for key in ("micro_batch_wait_ms", "micro_batch_max_tokens", "time_budget_ms",
+                                           "docid_map_path", "docids_are_pids") if kwargs.get(key)]
+            unsupported += [key for key in ("cascade_keep",) if getattr(resolved, key)]
+            error.value_check("<SMPL41590279E>", not unsupported,
+                              "{} not supported with num_replicas", ", ".join(unsupported))
+
+            pool = RerankPool(checkpoint, config, kwargs["num_replicas"], kwargs.get("threads_per_replica"),
+                              **({"request_timeout_s": kwargs["replica_timeout_s"]} if "replica_timeout_s" in kwargs else {}))
+            return cls(None, pool=pool)
 
         model = Searcher(
             None,
-            checkpoint=pretrained_model_name_or_path + "/watbert.dnn.model",
+            checkpoint=checkpoint,
             collection=None,
             config=config,
-            rescore_only=True
+            rescore_only=config.index_path is None
         )
-        return cls(model)
+
+        module_kwargs = {key: kwargs[key] for key in ("micro_batch_wait_ms", "micro_batch_max_tokens", "time_budget_ms", "docids_are_pids") if key in kwargs}
+
+        if kwargs.get("docid_map_path"):
+            with open(kwargs["docid_map_path"]) as f:
+                module_kwargs["docid_to_pid"] = {docid: int(pid) for docid, pid in (line.rstrip('\n').split('\t')[:2] for line in f)}
+
+        return cls(model, **module_kwargs)
 
     # def run(self, queries: List[str], documents: List[str]) -> DocumentRerankPrediction:
     def run(self, queries: List[str], documents: SentenceRerankDocumentsList, *args, **kwargs) -> DocumentRerankPrediction:
@@ -123,11 +216,20 @@ class Rerank(ModuleBase):
                 Optional
             include_title: boolean 
                 Optional
+            time_budget_ms: float
+                Optional. Once the request has run this long, no further document
+                batches are encoded: each query's rescored documents are ranked
+                first, followed by the others in their incoming order and with
+                their incoming score. Documents are rescored in order of their
+                incoming score, so the best candidates are reranked first.
+                Queries are rescored one after the other, each while time is
+                left. Only plain rescoring supports a budget: it is rejected
+                with num_replicas, an index, cascade_keep or micro-batching.
         Returns:
             DocumentRerankPrediction
         """
 
-        print(f"RUN: {queries=} {documents=}")
+        start = time.monotonic()
 
         max_num_documents = (
             kwargs["max_num_documents"]
@@ -141,26 +243,192 @@ class Rerank(ModuleBase):
             else self.include_title
         )
 
+        time_budget_ms = (
+            kwargs["time_budget_ms"]
+            if "time_budget_ms" in kwargs
+            else self.time_budget_ms
+        )
+
+        doc_groups = [docs.documents for docs in documents.documents[:len(queries)]]
+        text_groups = [self._document_texts(docs, include_title) for docs in doc_groups]
+
+        num_documents = sum(len(docs) for docs in doc_groups)
+        telemetry.observe_size("request_queries", len(queries))
+        telemetry.observe_size("request_documents", num_documents)
+
+        if telemetry.sampled():
+            logger.info("Rerank request: %d queries, %d documents, queries=%s", len(queries), num_documents, queries)
+
+        with telemetry.timed("request"):
+            return self._run(queries, doc_groups, text_groups, include_title, max_num_documents, time_budget_ms, start)
+
+    def _run(self, queries, doc_groups, text_groups, include_title, max_num_documents, time_budget_ms, start):
+        if time_budget_ms is not None:
+            self._check_time_budget()
+
+            deadline = start + time_budget_ms / 1000.0
+            ranking_results = []
+            for query, docs, texts in zip(queries, doc_groups, text_groups):
+                ranking_results.append(self._budgeted_prediction(query, docs, texts, deadline, include_title, max_num_documents))
+
+            return DocumentRerankPrediction(results=ranking_results)
+
+        all_scores, all_rescored = self._rescore(queries[:len(text_groups)], doc_groups, text_groups, include_title)
+
         ranking_results = []
-        for query, docs in zip(queries, documents.documents):
-            texts = []
-            for p in docs.documents:
-                if include_title and 'title' in p['document'] and p['document']['title'] is not None and len(p['document']['title'].strip()) > 0:
-                    texts.append(p['document']['title'] + '\n\n' + p['document']['text'])
-                else:
-                    texts.append(p.document.text)
+        for query, docs, scores, rescored in zip(queries, doc_groups, all_scores, all_rescored):
+            ranking_results.append(self._prediction(query, docs, scores, max_num_documents, rescored))
+
+        return DocumentRerankPrediction(results=ranking_results)
+
+    def _check_time_budget(self):
+        """Budgeted requests run `rescore_until`: reject the settings whose path it would bypass."""
+        error.value_check("<SMPL29604735E>", self.pool is None,
+                          "time_budget_ms is not supported with num_replicas")
+        error.value_check("<SMPL29604736E>", self.model.rescore_only,
+                          "time_budget_ms is not supported when reranking from an index")
+        error.value_check("<SMPL29604737E>", not self.model.config.cascade_keep,
+                          "time_budget_ms is not supported with cascade_keep")
+        error.value_check("<SMPL29604738E>", self.batcher is None,
+                          "time_budget_ms is not supported with micro_batch_wait_ms")
+
+    def _rescore(self, queries, doc_groups, text_groups, include_title):
+        """Scores every group. Returns the scores and, per group, which documents were fully
+        rescored (None when all of them were)."""
+        unmasked = [None] * len(text_groups)
+
+        if self.pool is not None:
+            return self.pool.submit(queries, text_groups, include_title=include_title), unmasked
+        elif not self.model.rescore_only:
+            return self._rescore_from_index(queries, doc_groups, text_groups, include_title), unmasked
+        elif self.model.config.cascade_keep:
+            config = self.model.config
+            return self.model.rescore_cascade(queries, text_groups, config.cascade_keep, config.cascade_prefix_maxlen,
+                                              include_title=include_title)
+        elif self.batcher is not None:
+            return self.batcher.submit(queries, text_groups, include_title=include_title), unmasked
+        else:
+            return self.model.rescore_batch(queries, text_groups, include_title=include_title), unmasked
+
+    @staticmethod
+    def _rank(scores, max_num_documents, rescored=None):
+        """Returns the indexes of the top `max_num_documents` documents, best first, and how
+        many documents were fully rescored."""
+        with telemetry.timed("sorting"):
+            if rescored is None:
+                ranked_passage_indexes = np.asarray(scores).argsort()[::-1]
+                num_rescored = len(scores)
+            else:
+                # fully rescored documents first, then the prescreened ones, each by score
+                rescored = rescored.numpy()
+                ranked_passage_indexes = np.lexsort((-np.asarray(scores), ~rescored))
+                num_rescored = int(rescored.sum())
+
+            ranked_passage_indexes = ranked_passage_indexes[:max_num_documents if max_num_documents > 0 else len(scores)].tolist()
 
-            scores = self.model.rescore(query, texts).tolist()
-            ranked_passage_indexes = np.array(scores).argsort()[::-1][:max_num_documents if max_num_documents > 0 else len(scores)].tolist()
+        return ranked_passage_indexes, num_rescored
 
+    @staticmethod
+    def _prediction(query, docs, scores, max_num_documents, rescored=None) -> SentenceRerankPrediction:
+        scores = scores.tolist()
+        ranked_passage_indexes, num_rescored = Rerank._rank(scores, max_num_documents, rescored)
+
+        with telemetry.timed("response"):
             results = []
             for idx in ranked_passage_indexes:
-                docs.documents[idx].score = scores[idx]
-                print(type(docs.documents[idx]))
-                results.append(docs.documents[idx])
-            ranking_results.append(SentenceRerankPrediction(query, SentenceRerankDocumentsList([SentenceRerankDocuments(results)])))  # TODO: Is sentence=query correct here?
+                # documents only prescreened by the cascade keep their incoming score
+                if rescored is None or rescored[idx]:
+                    docs[idx].score = scores[idx]
+                results.append(docs[idx])
 
-        return DocumentRerankPrediction(results=ranking_results)
+            return SentenceRerankPrediction(query, SentenceRerankDocumentsList([SentenceRerankDocuments(results)]), num_rescored)  # TODO: Is sentence=query correct here?
+
+    def _budgeted_rank(self, query, texts, incoming_scores, deadline, include_title, max_num_documents):
+        """Rescores documents by decreasing incoming score until `deadline`. Returns the indexes of the
+        top `max_num_documents` documents (rescored ones first, by score, then the others in their
+        incoming order), the new scores of the rescored ones, and how many were rescored."""
+        # Best incoming scores first; documents without one go last
+        order = sorted(range(len(texts)), key=lambda idx: -incoming_scores[idx] if incoming_scores[idx] is not None else float("inf"))
+
+        scores = self.model.rescore_until(query, [texts[idx] for idx in order], deadline, include_title=include_title).tolist()
+        rescored = order[:len(scores)]
+
+        with telemetry.timed("sorting"):
+            ranked = np.array(scores).argsort(kind="stable")[::-1].tolist()
+
+            ranked_passage_indexes = [rescored[idx] for idx in ranked]
+            new_scores = [scores[idx] for idx in ranked]
+
+            rescored = set(rescored)
+            ranked_passage_indexes.extend(idx for idx in range(len(texts)) if idx not in rescored)
+
+        if len(scores) < len(texts):
+            telemetry.increment("time_budget_exceeded")
+            logger.info("Time budget exceeded: rescored %d of %d documents", len(scores), len(texts))
+
+        ranked_passage_indexes = ranked_passage_indexes[:max_num_documents if max_num_documents > 0 else len(texts)]
+        return ranked_passage_indexes, new_scores, len(scores)
+
+    def _budgeted_prediction(self, query, docs, texts, deadline, include_title, max_num_documents) -> SentenceRerankPrediction:
+        ranked_passage_indexes, scores, num_rescored = self._budgeted_rank(
+            query, texts, [doc.score for doc in docs], deadline, include_title, max_num_documents)
+
+        with telemetry.timed("response"):
+            results = []
+            for rank, idx in enumerate(ranked_passage_indexes):
+                if rank < num_rescored:
+                    docs[idx].score = scores[rank]
+                results.append(docs[idx])
+
+            return SentenceRerankPrediction(query, SentenceRerankDocumentsList([SentenceRerankDocuments(results)]), num_rescored)
+
+    def _pid(self, docid):
+        if self.docid_to_pid is not None:
+            return self.docid_to_pid.get(docid)
+
+        if self.docids_are_pids and docid is not None and docid.isdigit() and int(docid) < len(self.model.ranker.doclens):
+            return int(docid)
+
+        return None
+
+    def _rescore_from_index(self, queries, doc_groups, text_groups, include_title):
+        """Score indexed documents from their compressed embeddings and re-encode only the others."""
+        pid_groups = [[self._pid(docid) for docid in self._docids(docs)] for docs in doc_groups]
+        unindexed = [[idx for idx, pid in enumerate(pids) if pid is None] for pids in pid_groups]
+
+        fallback_scores = [torch.zeros(0) for _ in unindexed]
+        if any(unindexed):
+            fallback_texts = [[texts[idx] for idx in idxs] for texts, idxs in zip(text_groups, unindexed)]
+            fallback_scores = self.model.rescore_batch(queries, fallback_texts, include_title=include_title)
+
+        all_scores = []
+        for query, pids, idxs, fallback in zip(queries, pid_groups, unindexed, fallback_scores):
+            scores = torch.zeros(len(pids))
+
+            indexed = [idx for idx, pid in enumerate(pids) if pid is not None]
+            if indexed:
+                scores[indexed] = self.model.rescore_pids(query, [pids[idx] for idx in indexed]).cpu().float()
+            if idxs:
+                scores[idxs] = fallback.cpu().float()
+
+            all_scores.append(scores)
+
+        return all_scores
+
+    @staticmethod
+    def _docids(docs: List[SentenceRerankDocument]) -> List[str]:
+        return [p.document.docid for p in docs]
+
+    @staticmethod
+    def _document_texts(docs: List[SentenceRerankDocument], include_title: bool) -> List[str]:
+        texts = []
+        for p in docs:
+            if include_title and 'title' in p['document'] and p['document']['title'] is not None and len(p['document']['title'].strip()) > 0:
+                texts.append(p['document']['title'] + '\n\n' + p['document']['text'])
+            else:
+                texts.append(p.document.text)
+
+        return texts
     
     # def encode(self, text: TextQueries):
     #     queries = text if isinstance(text, list) else [text]
@@ -171,22 +439,39 @@ class Rerank(ModuleBase):
 
     #     return Q
 
-    # def save(self, model_path, *args, **kwargs):
-    #     """Function to save model in caikit format.
-    #     This will generate store models on disk in a folder, which would be directly
-    #     consumable by caikit.runtime framework.
+    def save(self, model_path, *args, **kwargs):
+        """Function to save model in caikit format.
+        This will generate store models on disk in a folder, which would be directly
+        consumable by caikit.runtime framework.
 
-    #     Args:
-    #         model_path: str
-    #             Path to store model into
-    #     """
-    #     module_saver = ModuleSaver(
-    #         self,
-    #         model_path=model_path,
-    #     )
-    #     with module_saver:
-    #         rel_path, _ = module_saver.add_dir("watbert_model")
-    #         module_saver.update_config({"watbert_artifact_path": rel_path})
+        The checkpoint is written as a single safetensors file next to its HF
+        config and tokenizer, which `load` memory-maps instead of unpickling:
+        workers loading the same model share its pages through the page cache.
+
+        Args:
+            model_path: str
+                Path to store model into
+        """
+        module_saver = ModuleSaver(
+            self,
+            model_path=model_path,
+        )
+        model = self.model
+        if self.pool is not None:
+            # the replicas hold the model: save the full precision checkpoint they were loaded from
+            config = ColBERTConfig.from_existing(self.pool.config, ColBERTConfig(quantize_int8=False, onnx_encoder_path=None))
+            model = Searcher(None, checkpoint=self.pool.checkpoint, collection=None, config=config, rescore_only=True)
+
+        with module_saver:
+            rel_path, abs_path = module_saver.add_dir("watbert_model")
+            model.checkpoint.save_mapped(abs_path)
+            module_saver.update_config({
+                "watbert_artifact_path": rel_path,
+                "colbert_config": {
+                    "doc_maxlen": model.config.doc_maxlen,
+                    "query_maxlen": model.config.query_maxlen,
+                },
+            })
 
     # @classmethod
     # def bootstrap(cls, pretrained_model_path):
@@ -0,0 +1,202 @@
+# Copyright The Caikit Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import alog
+from caikit.core import ModuleBase, ModuleConfig, TaskBase, module, task
+from caikit.core.toolkit.errors import error_handler
+from caikit_template.data_model.document_rerank import DocumentRerankPrediction, SentenceRerankPrediction, SentenceRerankDocumentsList, SentenceRerankDocuments, SentenceRerankDocument, SentenceRerankDict
+from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
+from caikit_template.toolkit.colbert.searcher import Searcher
+
+import csv
+import numpy as np
+from typing import List
+import os
+
+logger = alog.use_channel("<SMPL_BLK>")
+error = error_handler.get(logger)
+
+
+@task(
+    required_parameters={
+        "queries": List[str],
+    },
+    output_type=DocumentRerankPrediction,
+)
+class RetrieveTask(TaskBase):
+    pass
+
+@module(
+    "00110203-0405-0607-0809-0a0b02dd0e1f",
+    "RetrieverModule",
+    "0.0.1",
+    RetrieveTask,
+)
+class Retrieve(ModuleBase):
+
+    def __init__(
+        self,
+        model,
+        collection=None,
+        k=10,
+        rescore=False,
+        rescore_depth=100
+    ) -> None:
+        """Function to initialize the Retriever.
+        This function gets called by `.load` which initializes this module.
+
+        Args:
+            model: Searcher
+                Searcher built over a PLAID index
+            collection: Dict[int, Dict[str, str]]
+                Optional passage text and title by pid, used to fill in the
+                returned documents and required by retrieve-then-rescore
+            k: int
+                Number of documents returned per query
+            rescore: boolean
+                Rescore the top `rescore_depth` candidates with the full precision
+                encoder instead of returning the index scores
+        """
+
+        super().__init__()
+        self.model = model
+        self.collection = collection
+        self.k = k
+        self.rescore = rescore
+        self.rescore_depth = rescore_depth
+
+    @classmethod
+    def load(cls, model_path: str):
+        """Load a model from disk.
+        The model directory holds the checkpoint (`watbert.dnn.model`), the
+        index (`index_path`, default `index`) and optionally the collection
+        (`collection_path`, default `collection.tsv`).
+        Args:
+            model_path: str
+                The path to the directory where the model is to be loaded from.
+        Returns:
+            Retrieve
+        """
+        config = ModuleConfig.load(model_path)
+
+        kwargs = dict(config.colbert_config or {})
+        kwargs["index_path"] = os.path.join(model_path, config.index_path or "index")
+
+        collection_path = os.path.join(model_path, config.collection_path or "collection.tsv")
+        if os.path.exists(collection_path):
+            kwargs["collection_path"] = collection_path
+
+        return cls.bootstrap(model_path, **kwargs)
+
+    @classmethod
+    def bootstrap(cls, pretrained_model_name_or_path: str, index_path: str, **kwargs):
+        """Load a non-caikit model and its index
+        Args:
+            pretrained_model_name_or_path: str
+                Path to non-caikit model.
+            index_path: str
+                Path to a PLAID index built with that model.
+            **kwargs:
+                Optional ColBERTConfig settings for the Searcher (e.g. ncells,
+                centroid_score_threshold, ndocs), the module settings k, rescore
+                and rescore_depth, and collection_path.
+        """
+
+        config = ColBERTConfig(
+            index_root=None,
+            index_name=None,
+            index_path=index_path,
+            query_maxlen=32
+        )
+        config.configure(**kwargs)
+
+        checkpoint = os.path.join(pretrained_model_name_or_path, "watbert.dnn.model")
+        if not os.path.exists(checkpoint):
+            checkpoint = pretrained_model_name_or_path
+
+        model = Searcher(
+            None,
+            checkpoint=checkpoint,
+            collection=None,
+            config=config
+        )
+
+        collection = None
+        if kwargs.get("collection_path"):
+            collection = cls._load_collection(kwargs["collection_path"])
+
+        module_kwargs = {key: kwargs[key] for key in ("k", "rescore", "rescore_depth") if key in kwargs}
+        return cls(model, collection=collection, **module_kwargs)
+
+    @staticmethod
+    def _load_collection(collection_path):
+        # Same layout as the indexing collection: pid, passage and optional title, tab-separated.
+        # Keyed by the pid column rather than the row, so that a file with gaps or out of order still maps right
+        collection = {}
+        with open(collection_path) as f:
+            for row in csv.DictReader(f, fieldnames=["pid", "passage", "title"], delimiter="\t"):
+                if row["pid"] == "id":
+                    continue
+                collection[int(row["pid"])] = {"text": row["passage"], "title": row["title"] or ""}
+
+        return collection
+
+    def run(self, queries: List[str], *args, **kwargs) -> DocumentRerankPrediction:
+        """Run retrieval on the index.
+        Args:
+            queries: List[str]
+            k: int
+                Optional
+            rescore: boolean
+                Optional
+        Returns:
+            DocumentRerankPrediction
+        """
+
+        k = kwargs["k"] if "k" in kwargs else self.k
+        rescore = kwargs["rescore"] if "rescore" in kwargs else self.rescore
+
+        error.value_check("<SMPL75316204E>", not rescore or self.collection is not None,
+                          "retrieve-then-rescore needs the collection next to the index")
+
+        depth = max(k, self.rescore_depth) if rescore else k
+
+        Q = self.model.encode(list(queries))
+        all_pids, all_scores = [], []
+        for query_idx in range(len(queries)):
+            pids, _, scores = self.model.dense_search(Q[query_idx:query_idx+1], k=depth)
+            all_pids.append(pids)
+            all_scores.append(scores)
+
+        if rescore:
+            text_groups = [[self.collection[pid]["text"] for pid in pids] for pids in all_pids]
+            all_scores = [scores.tolist() for scores in self.model.rescore_batch(list(queries), text_groups)]
+
+        ranking_results = []
+        for query_index, (query, pids, scores) in enumerate(zip(queries, all_pids, all_scores)):
+            ranked = np.array(scores).argsort(kind="stable")[::-1][:k].tolist()
+
+            results = [SentenceRerankDocument(self._document(pids[idx]), scores[idx]) for idx in ranked]
+            num_rescored = len(results) if rescore else 0
+            ranking_results.append(SentenceRerankPrediction(query, SentenceRerankDocumentsList([SentenceRerankDocuments(results)]),
+                                                            num_rescored, query_index))
+
+        return DocumentRerankPrediction(results=ranking_results)
+
+    def _document(self, pid):
+        if self.collection is None:
+            return SentenceRerankDict(text="", title="", docid=str(pid))
+
+        passage = self.collection[pid]
+        return SentenceRerankDict(text=passage["text"], title=passage["title"], docid=str(pid))
@@ -0,0 +1,116 @@
+# Copyright The Caikit Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import alog
+from caikit.core import TaskBase, module, task
+from caikit_template.data_model.document_rerank import SentenceRerankPrediction, SentenceRerankDocumentsList
+from caikit_template.modules.reranker import Rerank
+
+import time
+from typing import Iterable, List
+
+logger = alog.use_channel("<SMPL_BLK>")
+
+
+@task(
+    required_parameters={
+        "queries": List[str],
+        "documents": SentenceRerankDocumentsList,
+    },
+    output_type=Iterable[SentenceRerankPrediction],
+)
+class StreamingRerankTask(TaskBase):
+    pass
+
+@module(
+    "00110203-0405-0607-0809-0a0b02dd0e2f",
+    "StreamingRerankerModule",
+    "0.0.1",
+    StreamingRerankTask,
+)
+class StreamingRerank(Rerank):
+    """Reranker that streams one SentenceRerankPrediction per query as soon as
+    that query's documents are scored, instead of one DocumentRerankPrediction
+    once all of them are. Loads and saves like Rerank.
+    """
+
+    def run(self, queries: List[str], documents: SentenceRerankDocumentsList, *args, **kwargs) -> Iterable[SentenceRerankPrediction]:
+        """Run inference on model, yielding each query's result as it is ready.
+        Args:
+            queries: List[str]
+            documents:  SentenceRerankDocumentsList
+            max_num_documents: int
+                Optional
+            include_title: boolean
+                Optional
+            in_order: boolean
+                Optional. Process (and yield) the queries in the order they
+                arrived. By default the cheapest query groups are scored first,
+                so that the first results come back as early as possible.
+                Every result carries the position of its query in
+                `query_index`.
+            time_budget_ms: float
+                Optional. As for Rerank, over the whole stream: once it has run
+                out, the documents of the remaining queries keep their incoming
+                order and score.
+        Returns:
+            Iterable[SentenceRerankPrediction]
+        """
+
+        start = time.monotonic()
+
+        max_num_documents = (
+            kwargs["max_num_documents"]
+            if "max_num_documents" in kwargs
+            else self.max_num_documents
+        )
+
+        include_title = (
+            kwargs["include_title"]
+            if "include_title" in kwargs
+            else self.include_title
+        )
+
+        time_budget_ms = (
+            kwargs["time_budget_ms"]
+            if "time_budget_ms" in kwargs
+            else self.time_budget_ms
+        )
+
+        in_order = kwargs.get("in_order", False)
+
+        doc_groups = [docs.documents for docs in documents.documents[:len(queries)]]
+        text_groups = [self._document_texts(docs, include_title) for docs in doc_groups]
+
+        order = list(range(len(text_groups)))
+        if not in_order:
+            order.sort(key=lambda idx: sum(len(text) for text in text_groups[idx]))
+
+        deadline = None
+        if time_budget_ms is not None:
+            self._check_time_budget()
+            deadline = start + time_budget_ms / 1000.0
+
+        for idx in order:
+            if deadline is not None:
+                prediction = self._budgeted_prediction(queries[idx], doc_groups[idx], text_groups[idx], deadline,
+                                                       include_title, max_num_documents)
+            else:
+                (scores,), (rescored,) = self._rescore([queries[idx]], [doc_groups[idx]], [text_groups[idx]], include_title)
+                prediction = self._prediction(queries[idx], doc_groups[idx], scores, max_num_documents, rescored)
+
+            prediction.query_index = idx
+
+            logger.debug("Streaming the result of query %d", idx)
+            yield prediction
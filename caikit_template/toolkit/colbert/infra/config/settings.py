@@ -105,6 +105,18 @@ class DocSettings:
     doc_maxlen: int = DefaultVal(180)
     mask_punctuation: bool = DefaultVal(True)
 
+    # document token pruning: keep at most doc_prune_k tokens per document, chosen by doc_prune_policy,
+    # one of 'norm' (pre-normalization embedding norm), 'idf' (table at doc_prune_idf_path)
+    # or 'stopwords' (drop the words listed at doc_prune_stopwords_path, or a built-in English list)
+    doc_prune_k: int = DefaultVal(None)
+    doc_prune_policy: str = DefaultVal('norm')
+    doc_prune_idf_path: str = DefaultVal(None)
+    doc_prune_stopwords_path: str = DefaultVal(None)
+
+    # encode document batches with their sequences packed into as few rows as possible, separated by a
+    # block-diagonal attention mask, instead of padded to the longest one
+    doc_packed_encoder: bool = DefaultVal(False)
+
 
 @dataclass
 class QuerySettings:
@@ -191,3 +203,34 @@ class SearchSettings:
     ncells: int = DefaultVal(None)
     centroid_score_threshold: float = DefaultVal(None)
     ndocs: int = DefaultVal(None)
+
+    # rescoring: documents are encoded in length-sorted batches of this size
+    rescore_bsize: int = DefaultVal(32)
+
+    # rescoring: byte budget of the document embedding cache (0 disables it)
+    doc_cache_max_bytes: int = DefaultVal(0)
+
+    # query embedding cache: maximum number of entries (0 disables it) and time-to-live in seconds
+    query_cache_size: int = DefaultVal(0)
+    query_cache_ttl: float = DefaultVal(None)
+
+    # cascade rescoring: prescreen documents truncated to cascade_prefix_maxlen tokens, then rescore only
+    # the top cascade_keep of each group at doc_maxlen (unset disables the cascade)
+    cascade_keep: int = DefaultVal(None)
+    cascade_prefix_maxlen: int = DefaultVal(48)
+
+    # inference autocast: 'fp32', 'bf16' (also on CPU) or 'fp16' (GPU only); unset means fp16 on GPU and fp32 on CPU
+    inference_precision: str = DefaultVal(None)
+
+    # CPU inference: int8 dynamic quantization of the encoder's and the projection's linear layers
+    quantize_int8: bool = DefaultVal(False)
+
+    # CPU inference: run the encoder and projection from this exported ONNX graph (or directory holding encoder.onnx)
+    onnx_encoder_path: str = DefaultVal(None)
+
+    # largest difference tolerated between the eager and the ONNX embeddings of a probe text, checked at load
+    onnx_parity_tolerance: float = DefaultVal(1e-3)
+
+    # run only the first encoder_layers layers of the encoder and project that layer's hidden states (unset runs
+    # them all); trades accuracy for latency without retraining, see utilities/layer_sweep.py to pick a value
+    encoder_layers: int = DefaultVal(None)
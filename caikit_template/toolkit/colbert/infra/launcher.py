@@ -118,15 +118,22 @@ def setup_new_process(callee, port, return_value_queue, config, *args):
 
 
 def print_memory_stats(message=''):
-    return  # FIXME: Add this back before release.
+    # memory_full_info() walks the process' memory maps, far too slow to run on every Searcher build:
+    # only report when debugging memory, with COLBERT_PRINT_MEMORY_STATS=True (needs psutil)
+    if os.getenv("COLBERT_PRINT_MEMORY_STATS", "False") != "True":
+        return
 
-    import psutil  # Remove before releases? Or at least make optional with try/except.
+    try:
+        import psutil
+    except ImportError:
+        print_message("[WARNING] COLBERT_PRINT_MEMORY_STATS needs psutil, which is not installed.")
+        return
 
     global_info = psutil.virtual_memory()
     total, available, used, free = global_info.total, global_info.available, global_info.used, global_info.free
 
     info = psutil.Process().memory_info()
-    rss, vms, shared = info.rss, info.vms, info.shared
+    rss, vms, shared = info.rss, info.vms, getattr(info, 'shared', 0)
     uss = psutil.Process().memory_full_info().uss
 
     gib = 1024 ** 3
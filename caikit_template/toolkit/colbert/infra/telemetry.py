@@ -0,0 +1,153 @@
+"""
+    Lightweight rerank pipeline telemetry: per-stage latency histograms, size histograms and counters,
+    recorded into a pluggable sink.
+
+    The default sink keeps everything in memory and can render it in the Prometheus text format. Swap it
+    with `set_sink` (e.g., for a `NullSink` or an adapter to another metrics library).
+"""
+
+import bisect
+import random
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        if self.count == 0:
+            return None
+
+        rank, cumulative = q * self.count, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+
+
+class MetricsSink:
+    """Interface of a telemetry sink."""
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        raise NotImplementedError
+
+    def increment(self, name, value=1):
+        raise NotImplementedError
+
+
+class NullSink(MetricsSink):
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        pass
+
+    def increment(self, name, value=1):
+        pass
+
+
+class InMemorySink(MetricsSink):
+    """Thread-safe in-memory histograms and counters, with a Prometheus text exporter."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            self.histograms[name].observe(value)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {name: {'count': h.count, 'sum': h.sum, 'p50': h.quantile(0.5), 'p95': h.quantile(0.95),
+                                 'p99': h.quantile(0.99)} for name, h in self.histograms.items()}
+            return {'histograms': histograms, 'counters': dict(self.counters)}
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def prometheus_text(self):
+        lines = []
+
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+
+                cumulative = 0
+                for bound, count in zip(h.buckets + (float('inf'),), h.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+
+                lines.append(f"{name}_sum {h.sum}")
+                lines.append(f"{name}_count {h.count}")
+
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name}_total counter")
+                lines.append(f"{name}_total {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+_sink = InMemorySink()
+_sample_rate = 0.01
+
+
+def get_sink():
+    return _sink
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink
+
+
+def set_sample_rate(sample_rate):
+    """Fraction of requests whose details are logged (see `sampled`)."""
+    global _sample_rate
+    _sample_rate = sample_rate
+
+
+def sampled():
+    return _sample_rate > 0 and random.random() < _sample_rate
+
+
+@contextmanager
+def timed(stage):
+    """Records the duration of the enclosed block in the `rerank_<stage>_seconds` histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _sink.observe(f"rerank_{stage}_seconds", time.perf_counter() - start)
+
+
+def observe_size(name, value):
+    _sink.observe(f"rerank_{name}", value, buckets=SIZE_BUCKETS)
+
+
+def increment(name, value=1):
+    _sink.increment(f"rerank_{name}", value)
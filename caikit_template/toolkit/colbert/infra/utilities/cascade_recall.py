@@ -0,0 +1,87 @@
+import random
+
+from argparse import ArgumentParser
+
+from caikit_template.toolkit.colbert.data import Collection, Queries, Ranking
+from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
+from caikit_template.toolkit.colbert.searcher import Searcher
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+def _topk(scores, k, kept=None):
+    if kept is None:
+        return set(scores.argsort(descending=True)[:k].tolist())
+
+    # kept documents outrank prescreened ones, as in Rerank
+    order = sorted(range(scores.numel()), key=lambda idx: (not kept[idx].item(), -scores[idx].item()))
+    return set(order[:k])
+
+
+def cascade_recall(searcher, queries, doc_groups, keeps, prefix_maxlens, depths=(1, 5, 10)):
+    """
+        Recall of the cascade's top-k with respect to the single-stage top-k, averaged over the queries,
+        for every (keep, prefix_maxlen) setting and every k in `depths`.
+    """
+
+    single = searcher.rescore_batch(queries, doc_groups)
+    single_topk = {k: [_topk(scores, k) for scores in single] for k in depths}
+
+    report = {}
+    for prefix_maxlen in prefix_maxlens:
+        for keep in keeps:
+            all_scores, all_kept = searcher.rescore_cascade(queries, doc_groups, keep, prefix_maxlen)
+
+            for k in depths:
+                recalls = [len(_topk(scores, k, kept) & expected) / len(expected)
+                           for scores, kept, expected in zip(all_scores, all_kept, single_topk[k]) if expected]
+
+                report[(prefix_maxlen, keep, k)] = sum(recalls) / len(recalls)
+
+    return report
+
+
+def main():
+    parser = ArgumentParser(description='Measure the recall loss of cascade rescoring against single-stage rescoring.')
+
+    parser.add_argument('--checkpoint', dest='checkpoint', required=True)
+    parser.add_argument('--queries', dest='queries', required=True)
+    parser.add_argument('--collection', dest='collection', required=True)
+    parser.add_argument('--ranking', dest='ranking', default=None, help='candidates per query (qid, pid, rank); random passages if omitted')
+    parser.add_argument('--num_queries', dest='num_queries', default=200, type=int)
+    parser.add_argument('--depth', dest='depth', default=100, type=int, help='candidates rescored per query')
+    parser.add_argument('--keep', dest='keeps', default=[10, 20, 50], type=int, nargs='+')
+    parser.add_argument('--prefix_maxlen', dest='prefix_maxlens', default=[32, 48, 64], type=int, nargs='+')
+    parser.add_argument('--topk', dest='depths', default=[1, 5, 10], type=int, nargs='+')
+    parser.add_argument('--doc_maxlen', dest='doc_maxlen', default=180, type=int)
+    parser.add_argument('--query_maxlen', dest='query_maxlen', default=32, type=int)
+    parser.add_argument('--rng_seed', dest='rng_seed', default=12345, type=int)
+
+    args = parser.parse_args()
+
+    random.seed(args.rng_seed)
+
+    queries = Queries(path=args.queries)
+    collection = Collection(path=args.collection)
+
+    qids = random.sample(list(queries.keys()), min(len(queries), args.num_queries))
+
+    if args.ranking:
+        ranking = Ranking(path=args.ranking).todict()
+        qids = [qid for qid in qids if qid in ranking]
+        doc_groups = [[collection[pid] for pid, *_ in ranking[qid][:args.depth]] for qid in qids]
+    else:
+        doc_groups = [[collection[pid] for pid in random.sample(range(len(collection)), min(len(collection), args.depth))]
+                      for _ in qids]
+
+    config = ColBERTConfig(index_root=None, index_name=None, index_path=None,
+                           doc_maxlen=args.doc_maxlen, query_maxlen=args.query_maxlen)
+    searcher = Searcher(None, checkpoint=args.checkpoint, config=config, rescore_only=True)
+
+    report = cascade_recall(searcher, [queries[qid] for qid in qids], doc_groups, args.keeps, args.prefix_maxlens, args.depths)
+
+    for (prefix_maxlen, keep, k), recall in report.items():
+        print_message(f"#> prefix_maxlen={prefix_maxlen} keep={keep} recall@{k}={recall:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import time
+import random
+
+from argparse import ArgumentParser
+
+import ujson
+
+from caikit_template.toolkit.colbert.data import Collection, Queries, Ranking
+from caikit_template.toolkit.colbert.evaluation.loaders import load_qrels
+from caikit_template.toolkit.colbert.evaluation.metrics import Metrics
+from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
+from caikit_template.toolkit.colbert.searcher import Searcher
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+def _evaluate(searcher, qids, queries, doc_groups, pid_groups, qrels, depths, bsize):
+    metrics = Metrics(mrr_depths=set(depths), recall_depths=set(depths), success_depths=set(depths),
+                      total_queries=len(qids))
+
+    elapsed = 0.0
+    for offset in range(0, len(qids), bsize):
+        start = time.perf_counter()
+        all_scores = searcher.rescore_batch([queries[qid] for qid in qids[offset:offset+bsize]], doc_groups[offset:offset+bsize])
+        elapsed += time.perf_counter() - start
+
+        for idx, scores in enumerate(all_scores, start=offset):
+            order = scores.argsort(descending=True).tolist()
+            ranking = [(rank + 1, pid_groups[idx][pos], scores[pos].item()) for rank, pos in enumerate(order)]
+            metrics.add(idx, qids[idx], ranking, qrels[qids[idx]])
+
+    num_queries = len(qids)
+    report = {'ms_per_query': 1000 * elapsed / num_queries}
+
+    for name, sums in [('MRR', metrics.mrr_sums), ('Success', metrics.success_sums), ('Recall', metrics.recall_sums)]:
+        for depth in sorted(sums):
+            report[f'{name}@{depth}'] = sums[depth] / num_queries
+
+    return report
+
+
+def sweep_encoder_layers(searcher, qids, queries, doc_groups, pid_groups, qrels, layers=None, depths=(10, 50), bsize=16):
+    """
+        Reranks the candidates of every query with the first N encoder layers, for every N in `layers` (all of
+        them by default, deepest first), and reports the ranking metrics, the latency per query and the speedup
+        over the full encoder of each N. The full encoder is always evaluated, as the baseline, even when
+        `layers` leaves it out.
+    """
+
+    checkpoint = searcher.checkpoint
+    current_layers = len(checkpoint.bert.encoder.layer)
+
+    # the checkpoint may already run truncated (encoder_layers): count the layers kept aside too
+    num_layers = len(getattr(checkpoint, 'all_encoder_layers', checkpoint.bert.encoder.layer))
+    layers = sorted(set(layers or range(1, num_layers + 1)) | {num_layers}, reverse=True)
+
+    # warm-up, so that the first setting does not pay for one-off allocations
+    searcher.rescore_batch([queries[qids[0]]], doc_groups[:1])
+
+    report = {}
+    for n in layers:
+        checkpoint.use_encoder_layers(n)
+        report[n] = _evaluate(searcher, qids, queries, doc_groups, pid_groups, qrels, depths, bsize)
+
+    checkpoint.use_encoder_layers(current_layers)
+
+    full = report[num_layers]
+    for n in report:
+        report[n]['speedup'] = full['ms_per_query'] / report[n]['ms_per_query']
+
+    return report
+
+
+def main():
+    parser = ArgumentParser(description='Sweep the number of encoder layers used for reranking: ranking quality and latency of each.')
+
+    parser.add_argument('--checkpoint', dest='checkpoint', required=True)
+    parser.add_argument('--queries', dest='queries', required=True)
+    parser.add_argument('--collection', dest='collection', required=True)
+    parser.add_argument('--qrels', dest='qrels', required=True)
+    parser.add_argument('--ranking', dest='ranking', required=True, help='candidates per query (qid, pid, rank), e.g. BM25 top-k')
+    parser.add_argument('--layers', dest='layers', default=None, type=int, nargs='+', help='encoder depths to evaluate, besides the full depth; all by default')
+    parser.add_argument('--num_queries', dest='num_queries', default=500, type=int)
+    parser.add_argument('--depth', dest='depth', default=100, type=int, help='candidates reranked per query')
+    parser.add_argument('--metric_depths', dest='depths', default=[10, 50], type=int, nargs='+')
+    parser.add_argument('--bsize', dest='bsize', default=16, type=int, help='queries per rescore_batch call')
+    parser.add_argument('--doc_maxlen', dest='doc_maxlen', default=180, type=int)
+    parser.add_argument('--query_maxlen', dest='query_maxlen', default=32, type=int)
+    parser.add_argument('--output', dest='output', default=None, help='optional JSON report')
+    parser.add_argument('--rng_seed', dest='rng_seed', default=12345, type=int)
+
+    args = parser.parse_args()
+
+    random.seed(args.rng_seed)
+
+    queries = Queries(path=args.queries)
+    collection = Collection(path=args.collection)
+    qrels = load_qrels(args.qrels)
+    ranking = Ranking(path=args.ranking).todict()
+
+    qids = [qid for qid in queries.keys() if qid in qrels and qid in ranking]
+    qids = random.sample(qids, min(len(qids), args.num_queries))
+
+    pid_groups = [[pid for pid, *_ in ranking[qid][:args.depth]] for qid in qids]
+    doc_groups = [[collection[pid] for pid in pids] for pids in pid_groups]
+
+    config = ColBERTConfig(index_root=None, index_name=None, index_path=None,
+                           doc_maxlen=args.doc_maxlen, query_maxlen=args.query_maxlen)
+    searcher = Searcher(None, checkpoint=args.checkpoint, config=config, rescore_only=True)
+
+    report = sweep_encoder_layers(searcher, qids, queries, doc_groups, pid_groups, qrels, args.layers, args.depths, args.bsize)
+
+    for n, row in report.items():
+        print_message(f"#> encoder_layers={n}: " + ' '.join(f"{key}={value:.4f}" for key, value in row.items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            ujson.dump(report, f, indent=4)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import time
+import string
+import torch
+
+from argparse import ArgumentParser
+
+from caikit_template.toolkit.colbert.modeling.colbert import skiplist_mask, skiplist_token_ids
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+def _list_mask(input_ids, skiplist):
+    # the former ColBERT.mask: a Python pass over every token id, then back to a tensor on the device
+    mask = [[(x not in skiplist) and (x != 0) for x in d] for d in input_ids.cpu().tolist()]
+    return torch.tensor(mask, device=input_ids.device)
+
+
+def _index_put_markers(ids, mask, marker_id, mask_token_id):
+    # the former QueryTokenizer post-processing, with boolean-indexed assignments
+    ids[:, 1] = marker_id
+    ids[ids == 0] = mask_token_id
+    mask[ids == mask_token_id] = 1
+    return ids, mask
+
+
+def _masked_fill_markers(ids, mask, marker_id, mask_token_id):
+    ids[:, 1] = marker_id
+    ids.masked_fill_(ids == 0, mask_token_id)
+    mask.masked_fill_(ids == mask_token_id, 1)
+    return ids, mask
+
+
+def _timed(fn, repeats, device):
+    fn()  # warm-up
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        output = fn()
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+    return output, (time.perf_counter() - start) / repeats
+
+
+def synthetic_batch(bsize, maxlen, vocab_size=30522, seed=12345):
+    """Random token ids with [CLS] first and zero padding after a random length per row, as a tokenizer emits."""
+    generator = torch.Generator().manual_seed(seed)
+
+    ids = torch.randint(1000, vocab_size, (bsize, maxlen), generator=generator)
+    ids[:, 0] = 101
+
+    lengths = torch.randint(maxlen // 4, maxlen + 1, (bsize,), generator=generator)
+    ids[torch.arange(maxlen).unsqueeze(0) >= lengths.unsqueeze(1)] = 0
+
+    return ids, (ids != 0).long()
+
+
+def benchmark_masking(bsize=64, doc_maxlen=180, query_maxlen=32, repeats=100, device='cpu'):
+    """
+        Per-batch cost, in microseconds, of the list-based and the tensorized skiplist mask on a
+        `bsize` x `doc_maxlen` batch, and of the query marker post-processing with boolean-indexed
+        assignments and with `masked_fill_`. Checks that both versions agree.
+    """
+
+    device = torch.device(device)
+
+    # the BERT punctuation ids, as the skiplist of ColBERT holds them: symbols and ids
+    punctuation_ids = list(range(999, 999 + len(string.punctuation)))
+    skiplist = {w: True for symbol, token_id in zip(string.punctuation, punctuation_ids) for w in [symbol, token_id]}
+    ids = skiplist_token_ids(skiplist).to(device)
+
+    input_ids, _ = synthetic_batch(bsize, doc_maxlen)
+    input_ids[:, 2::7] = punctuation_ids[0]  # some punctuation in every document
+    input_ids = input_ids.to(device)
+
+    list_mask, list_time = _timed(lambda: _list_mask(input_ids, skiplist), repeats, device)
+    tensor_mask, tensor_time = _timed(lambda: skiplist_mask(input_ids, ids), repeats, device)
+
+    assert torch.equal(list_mask, tensor_mask)
+
+    query_ids, query_mask = synthetic_batch(bsize, query_maxlen)
+    query_ids, query_mask = query_ids.to(device), query_mask.to(device)
+
+    (index_ids, index_mask), index_time = _timed(
+        lambda: _index_put_markers(query_ids.clone(), query_mask.clone(), 1, 103), repeats, device)
+    (fill_ids, fill_mask), fill_time = _timed(
+        lambda: _masked_fill_markers(query_ids.clone(), query_mask.clone(), 1, 103), repeats, device)
+
+    assert torch.equal(index_ids, fill_ids) and torch.equal(index_mask, fill_mask)
+
+    return {
+        'skiplist_mask_list_us': list_time * 1e6,
+        'skiplist_mask_tensor_us': tensor_time * 1e6,
+        'skiplist_mask_speedup': list_time / tensor_time,
+        'query_markers_index_put_us': index_time * 1e6,
+        'query_markers_masked_fill_us': fill_time * 1e6,
+        'query_markers_speedup': index_time / fill_time,
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Micro-benchmark the skiplist mask and the query marker post-processing, before and after tensorizing them.')
+
+    parser.add_argument('--bsize', dest='bsize', default=64, type=int)
+    parser.add_argument('--doc_maxlen', dest='doc_maxlen', default=180, type=int)
+    parser.add_argument('--query_maxlen', dest='query_maxlen', default=32, type=int)
+    parser.add_argument('--repeats', dest='repeats', default=100, type=int)
+    parser.add_argument('--device', dest='device', default='cpu')
+
+    args = parser.parse_args()
+
+    report = benchmark_masking(args.bsize, args.doc_maxlen, args.query_maxlen, args.repeats, args.device)
+
+    for key, value in report.items():
+        print_message(f"#> {key}: {value:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import time
+import random
+
+from argparse import ArgumentParser
+
+from caikit_template.toolkit.colbert.data import Collection, Queries
+from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
+from caikit_template.toolkit.colbert.modeling.checkpoint import Checkpoint
+from caikit_template.toolkit.colbert.modeling.onnx_encoder import OnnxEncoder, export_onnx_encoder
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+def _timed(fn, repeats):
+    fn()  # warm-up
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        output = fn()
+
+    return output, (time.perf_counter() - start) / repeats
+
+
+def check_onnx_encoder(checkpoint, path, queries, docs, bsize=32, repeats=3):
+    """
+        Encodes `queries` and `docs` with the eager and the ONNX encoder of `checkpoint`, and reports the
+        largest absolute difference between their (normalized, masked) embeddings and the latency of each.
+    """
+
+    onnx_encoder = OnnxEncoder(path)
+    report = {}
+
+    for name, encode in [('query', lambda: checkpoint.queryFromText(queries, bsize=bsize)),
+                         ('doc', lambda: checkpoint.docFromText(docs, bsize=bsize))]:
+        checkpoint.onnx_encoder = None
+        eager, eager_time = _timed(encode, repeats)
+
+        checkpoint.onnx_encoder = onnx_encoder
+        exported, onnx_time = _timed(encode, repeats)
+
+        if isinstance(eager, tuple):
+            eager, exported = eager[0], exported[0]
+
+        report[f'{name}_max_abs_diff'] = (eager.float() - exported.float()).abs().max().item()
+        report[f'{name}_eager_ms'] = eager_time * 1000
+        report[f'{name}_onnx_ms'] = onnx_time * 1000
+        report[f'{name}_speedup'] = eager_time / onnx_time
+
+    checkpoint.onnx_encoder = None
+
+    return report
+
+
+def main():
+    parser = ArgumentParser(description='Export the ColBERT encoder to ONNX and check it against the eager encoder.')
+
+    parser.add_argument('--checkpoint', dest='checkpoint', required=True)
+    parser.add_argument('--output', dest='output', required=True, help='.onnx file or directory for encoder.onnx')
+    parser.add_argument('--opset', dest='opset', default=17, type=int)
+    parser.add_argument('--doc_maxlen', dest='doc_maxlen', default=180, type=int)
+    parser.add_argument('--query_maxlen', dest='query_maxlen', default=32, type=int)
+
+    # parity and latency check on a sample, skipped unless queries and collection are given
+    parser.add_argument('--queries', dest='queries', default=None)
+    parser.add_argument('--collection', dest='collection', default=None)
+    parser.add_argument('--sample', dest='sample', default=64, type=int)
+    parser.add_argument('--bsize', dest='bsize', default=32, type=int)
+    parser.add_argument('--tolerance', dest='tolerance', default=1e-3, type=float)
+    parser.add_argument('--rng_seed', dest='rng_seed', default=12345, type=int)
+
+    args = parser.parse_args()
+
+    config = ColBERTConfig(checkpoint=args.checkpoint, doc_maxlen=args.doc_maxlen, query_maxlen=args.query_maxlen)
+    checkpoint = Checkpoint(args.checkpoint, colbert_config=config)
+
+    path = export_onnx_encoder(checkpoint, args.output, opset_version=args.opset)
+
+    if not (args.queries and args.collection):
+        return
+
+    random.seed(args.rng_seed)
+
+    queries = list(Queries(path=args.queries).values())
+    queries = random.sample(queries, min(len(queries), args.sample))
+
+    collection = Collection(path=args.collection)
+    docs = [collection[pid] for pid in random.sample(range(len(collection)), min(len(collection), args.sample))]
+
+    report = check_onnx_encoder(checkpoint, path, queries, docs, bsize=args.bsize)
+
+    for key, value in report.items():
+        print_message(f"#> {key}: {value}")
+
+    worst = max(report['query_max_abs_diff'], report['doc_max_abs_diff'])
+    assert worst <= args.tolerance, f"ONNX embeddings differ from the eager ones by {worst} > {args.tolerance}"
+
+
+if __name__ == '__main__':
+    main()
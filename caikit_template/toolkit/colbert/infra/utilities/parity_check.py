@@ -0,0 +1,325 @@
+"""
+    Parity checks of the rerank fast paths against the plain paths they replace, on a tiny random-weight
+    checkpoint built locally (see `rerank_benchmark.build_tiny_checkpoint`) or on a given one. Every check
+    returns the largest absolute score difference between the two paths; `main` fails when one exceeds
+    the tolerance.
+
+        python -m caikit_template.toolkit.colbert.infra.utilities.parity_check
+"""
+
+import sys
+import random
+import tempfile
+import threading
+
+import torch
+
+from argparse import ArgumentParser
+
+from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
+from caikit_template.toolkit.colbert.infra.utilities.rerank_benchmark import build_tiny_checkpoint, _synthetic_texts, _synthetic_words
+from caikit_template.toolkit.colbert.modeling.colbert import colbert_score
+from caikit_template.toolkit.colbert.search.strided_tensor import StridedTensor
+from caikit_template.toolkit.colbert.searcher import Searcher
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+def _max_abs_diff(expected, actual):
+    return max([(x.cpu().float() - y.cpu().float()).abs().max().item() for x, y in zip(expected, actual) if x.numel()],
+               default=0.0)
+
+
+def check_batched_rescoring(searcher, queries, doc_groups):
+    """`rescore_batch` over all queries at once against `rescore` one query at a time."""
+
+    expected = [searcher.rescore(query, docs) for query, docs in zip(queries, doc_groups)]
+    actual = searcher.rescore_batch(queries, doc_groups)
+
+    return _max_abs_diff(expected, actual)
+
+
+def check_embedding_caches(searcher, queries, doc_groups):
+    """
+        `rescore_batch` with the query and document embedding caches, on a cold cache (all misses) and
+        again on a warm one (all hits), against `rescore_batch` without caches.
+    """
+
+    expected = searcher.rescore_batch(queries, doc_groups)
+
+    config = searcher.config
+    previous = {'doc_cache_max_bytes': config.doc_cache_max_bytes, 'query_cache_size': config.query_cache_size}
+
+    config.configure(doc_cache_max_bytes=64 * 1024 ** 2, query_cache_size=1024)
+    searcher.configure_caches()
+
+    try:
+        misses = searcher.rescore_batch(queries, doc_groups)
+        hits = searcher.rescore_batch(queries, doc_groups)
+    finally:
+        config.configure(**previous)
+        searcher.configure_caches()
+
+    return max(_max_abs_diff(expected, misses), _max_abs_diff(expected, hits))
+
+
+def check_micro_batching(searcher, queries, doc_groups):
+    """
+        One request per query submitted concurrently to a `RerankBatcher`, which merges them into shared
+        `rescore_batch` calls, against `rescore_batch` called directly.
+    """
+
+    from caikit_template.modules.rerank_batcher import RerankBatcher
+
+    expected = searcher.rescore_batch(queries, doc_groups)
+
+    batcher = RerankBatcher(searcher, max_wait_ms=50)
+    actual = [None] * len(queries)
+
+    def submit(idx):
+        actual[idx], = batcher.submit([queries[idx]], [doc_groups[idx]])
+
+    threads = [threading.Thread(target=submit, args=(idx,)) for idx in range(len(queries))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return _max_abs_diff(expected, actual)
+
+
+def check_packed_encoding(searcher, queries, doc_groups):
+    """Documents encoded with sequence packing (`doc_packed_encoder`) against the padded encoder batches."""
+
+    colbert_config = searcher.checkpoint.colbert_config
+    previous = colbert_config.doc_packed_encoder
+
+    try:
+        colbert_config.doc_packed_encoder = False
+        expected = searcher.rescore_batch(queries, doc_groups)
+
+        colbert_config.doc_packed_encoder = True
+        actual = searcher.rescore_batch(queries, doc_groups)
+    finally:
+        colbert_config.doc_packed_encoder = previous
+
+    return _max_abs_diff(expected, actual)
+
+
+def check_packed_scoring(searcher, queries, doc_groups):
+    """
+        Segmented MaxSim over packed documents (`Searcher._score_packed`) against `colbert_score` over the
+        same embeddings padded. The negated documents have mostly negative similarities, where a MaxSim
+        that starts at 0 instead of the true maximum would show.
+    """
+
+    expected, actual = [], []
+
+    for query, docs in zip(queries, doc_groups):
+        Q = searcher.encode([query])
+        D_packed, doclens = searcher.encode_documents_packed(docs)
+
+        for D in [D_packed, -D_packed]:
+            D_padded, D_mask = StridedTensor(D, doclens, use_gpu=False).as_padded_tensor()
+
+            expected.append(colbert_score(Q, D_padded, D_mask, searcher.config))
+            actual.append(searcher._score_packed(Q, D, doclens))
+
+    return _max_abs_diff(expected, actual)
+
+
+def check_cross_scoring(searcher, queries, doc_groups):
+    """
+        Every query against a shared pool of documents: `rescore_cross` (padded, blocked) and `rescore_batch`
+        on identical groups, which routes to it, against `rescore` one query at a time (packed).
+    """
+
+    pool = doc_groups[0]
+
+    expected = [searcher.rescore(query, pool) for query in queries]
+    cross = searcher.rescore_cross(queries, pool)
+    batch = searcher.rescore_batch(queries, [pool] * len(queries))
+
+    return max(_max_abs_diff(expected, cross), _max_abs_diff(expected, batch))
+
+
+class _StoredEmbeddings:
+    """Stands in for the index of `Searcher.rescore_pids`: decompresses pid i to the packed embeddings of `docs[i]`."""
+
+    def __init__(self, D_packed, doclens):
+        self.matrices = D_packed.split(doclens.tolist())
+
+    def decompress_pids(self, pids):
+        matrices = [self.matrices[pid] for pid in pids]
+        return torch.cat(matrices), torch.tensor([D.size(0) for D in matrices])
+
+
+def check_pid_rescoring(searcher, queries, doc_groups):
+    """
+        `rescore_pids` over stored embeddings against `colbert_score` over the same documents re-encoded and
+        padded. As in `check_packed_scoring`, the documents are also stored negated, where a MaxSim that
+        starts at 0 would show.
+    """
+
+    previous = searcher.rescore_only, getattr(searcher, 'ranker', None)
+    expected, actual = [], []
+
+    try:
+        searcher.rescore_only = False
+
+        for query, docs in zip(queries, doc_groups):
+            Q = searcher.encode([query])
+            D_packed, doclens = searcher.encode_documents_packed(docs)
+
+            for D in [D_packed, -D_packed]:
+                D_padded, D_mask = StridedTensor(D, doclens, use_gpu=False).as_padded_tensor()
+                expected.append(colbert_score(Q, D_padded, D_mask, searcher.config))
+
+                searcher.ranker = _StoredEmbeddings(D, doclens)
+                actual.append(searcher.rescore_pids(query, list(range(len(docs)))))
+    finally:
+        searcher.rescore_only, searcher.ranker = previous
+
+    return _max_abs_diff(expected, actual)
+
+
+def check_columnar_rerank(searcher, queries, doc_groups):
+    """
+        `ColumnarRerank.run` over flat columns against `rescore_batch` over the same groups. Also checks
+        that group offsets not starting at 0 are rejected.
+    """
+
+    from caikit_template.data_model.document_rerank import ColumnarRerankDocuments
+    from caikit_template.modules.columnar_reranker import ColumnarRerank
+
+    expected = searcher.rescore_batch(queries, doc_groups)
+
+    texts = [text for docs in doc_groups for text in docs]
+    offsets = [sum(len(docs) for docs in doc_groups[:idx]) for idx in range(len(doc_groups))]
+
+    rerank = ColumnarRerank(searcher)
+    prediction = rerank.run(queries, ColumnarRerankDocuments(texts=texts, titles=[], docids=[], scores=[], group_offsets=offsets),
+                            max_num_documents=-1)
+
+    flat = [0.0] * len(texts)
+    for idx, score in zip(prediction.indices, prediction.scores):
+        flat[idx] = score
+    actual = [torch.tensor(flat[begin:begin + len(docs)]) for begin, docs in zip(offsets, doc_groups)]
+
+    shifted = ColumnarRerankDocuments(texts=texts, titles=[], docids=[], scores=[], group_offsets=[offset + 1 for offset in offsets])
+    try:
+        rerank.run(queries, shifted, max_num_documents=-1)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("group_offsets not starting at 0 were accepted")
+
+    return _max_abs_diff(expected, actual)
+
+
+def check_save_reload(searcher, queries, doc_groups):
+    """
+        Saves the model with non-default serving settings and loads it back: the saved config must hold
+        their defaults, and the reloaded model must score as the saved one.
+    """
+
+    from caikit_template.toolkit.colbert.modeling.base_colbert import SERVING_SETTINGS
+
+    serving = {'cascade_keep': 5, 'rescore_bsize': 7, 'doc_cache_max_bytes': 1024 ** 2, 'query_cache_size': 16,
+               'inference_precision': 'fp32', 'doc_packed_encoder': True, 'encoder_layers': 1,
+               'onnx_encoder_path': 'encoder.onnx'}
+
+    colbert_config = searcher.checkpoint.colbert_config
+    previous = {name: getattr(colbert_config, name) for name in serving}
+
+    expected = searcher.rescore_batch(queries, doc_groups)
+
+    with tempfile.TemporaryDirectory() as path:
+        colbert_config.configure(**serving)
+        try:
+            searcher.checkpoint.save_mapped(path)
+        finally:
+            colbert_config.configure(**previous)
+
+        saved, defaults = ColBERTConfig.load_from_checkpoint(path), ColBERTConfig()
+        changed = [name for name in SERVING_SETTINGS if getattr(saved, name) != getattr(defaults, name)]
+        assert not changed, f"serving settings saved with the model: {changed}"
+
+        config = ColBERTConfig(index_root=None, index_name=None, index_path=None,
+                               doc_maxlen=searcher.config.doc_maxlen, query_maxlen=searcher.config.query_maxlen)
+        reloaded = Searcher(None, checkpoint=path, config=config, rescore_only=True)
+
+        return _max_abs_diff(expected, reloaded.rescore_batch(queries, doc_groups))
+
+
+CHECKS = {
+    'batched_rescoring': check_batched_rescoring,
+    'embedding_caches': check_embedding_caches,
+    'micro_batching': check_micro_batching,
+    'packed_encoding': check_packed_encoding,
+    'packed_scoring': check_packed_scoring,
+    'cross_scoring': check_cross_scoring,
+    'save_reload': check_save_reload,
+    'pid_rescoring': check_pid_rescoring,
+    'columnar_rerank': check_columnar_rerank,
+}
+
+
+def run_checks(checkpoint=None, checks=tuple(CHECKS), num_queries=4, docs_per_query=8, doc_length=24, seed=12345):
+    """
+        Runs every check in `checks` on synthetic queries and documents and returns their largest
+        absolute score differences. Builds a tiny random checkpoint in a temporary directory when
+        `checkpoint` is None.
+    """
+
+    tmpdir = None
+    if checkpoint is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        checkpoint = tmpdir.name
+        words = build_tiny_checkpoint(checkpoint, seed=seed)
+    else:
+        words = _synthetic_words(2000)
+
+    rng = random.Random(seed)
+    queries = _synthetic_texts(rng, words, num_queries, 8)
+    # lengths vary within a group, so that padding and packing differ
+    doc_groups = [[' '.join(rng.choices(words, k=rng.randint(1, doc_length))) for _ in range(docs_per_query)]
+                  for _ in queries]
+
+    config = ColBERTConfig(index_root=None, index_name=None, index_path=None, doc_maxlen=doc_length + 3, query_maxlen=32)
+    searcher = Searcher(None, checkpoint=checkpoint, config=config, rescore_only=True)
+
+    report = {}
+    with torch.no_grad():
+        for name in checks:
+            report[name] = CHECKS[name](searcher, queries, doc_groups)
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+    return report
+
+
+def main():
+    parser = ArgumentParser(description='Check that the rerank fast paths score like the plain paths they replace.')
+
+    parser.add_argument('--checkpoint', dest='checkpoint', default=None, help='a tiny random checkpoint is built if omitted')
+    parser.add_argument('--checks', dest='checks', default=list(CHECKS), choices=list(CHECKS), nargs='+')
+    parser.add_argument('--num_queries', dest='num_queries', default=4, type=int)
+    parser.add_argument('--docs_per_query', dest='docs_per_query', default=8, type=int)
+    parser.add_argument('--doc_length', dest='doc_length', default=24, type=int, help='longest document, in words (one token each)')
+    parser.add_argument('--tolerance', dest='tolerance', default=1e-3, type=float)
+    parser.add_argument('--rng_seed', dest='rng_seed', default=12345, type=int)
+
+    args = parser.parse_args()
+
+    report = run_checks(args.checkpoint, args.checks, args.num_queries, args.docs_per_query, args.doc_length, args.rng_seed)
+
+    for name, diff in report.items():
+        print_message(f"#> {name}: max_abs_diff={diff:.2e} {'ok' if diff <= args.tolerance else 'MISMATCH'}")
+
+    if any(diff > args.tolerance for diff in report.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
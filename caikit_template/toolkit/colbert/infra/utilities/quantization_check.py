@@ -0,0 +1,110 @@
+import time
+import random
+import torch
+
+from argparse import ArgumentParser
+
+from caikit_template.toolkit.colbert.data import Collection, Queries
+from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
+from caikit_template.toolkit.colbert.searcher import Searcher
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+def _ranks(scores):
+    return scores.argsort(descending=True).argsort().float()
+
+
+def _spearman(x, y):
+    rx, ry = _ranks(x), _ranks(y)
+    rx, ry = rx - rx.mean(), ry - ry.mean()
+
+    denominator = (rx.norm() * ry.norm()).item()
+    return (rx @ ry).item() / denominator if denominator > 0 else 1.0
+
+
+def _timed_rescore(searcher, queries, doc_groups, per_query=False):
+    start = time.perf_counter()
+
+    if per_query:
+        all_scores = [searcher.rescore(query, docs) for query, docs in zip(queries, doc_groups)]
+    else:
+        all_scores = searcher.rescore_batch(queries, doc_groups)
+
+    return [scores.cpu().float() for scores in all_scores], time.perf_counter() - start
+
+
+def compare_quantized_scores(checkpoint, queries, doc_groups, config=None, per_query=False):
+    """
+        Scores every (query, documents) group with the full precision and the int8 quantized encoder and
+        compares the two: absolute score differences, per-query Spearman correlation and top-1 agreement.
+
+        Scores come from the serving path: `Searcher.rescore_batch`, as `Rerank.run` calls it, or
+        `Searcher.rescore` once per query with `per_query`. Both encode the documents packed and score
+        them with `_score_packed` (segmented MaxSim on CPU).
+    """
+
+    config = ColBERTConfig.from_existing(config, ColBERTConfig(index_root=None, index_name=None, index_path=None))
+
+    fp32 = Searcher(None, checkpoint=checkpoint, config=ColBERTConfig.from_existing(config, ColBERTConfig(quantize_int8=False)), rescore_only=True)
+    int8 = Searcher(None, checkpoint=checkpoint, config=ColBERTConfig.from_existing(config, ColBERTConfig(quantize_int8=True)), rescore_only=True)
+
+    # warm-up, so that neither timing includes one-off allocations
+    _timed_rescore(fp32, queries[:1], doc_groups[:1], per_query)
+    _timed_rescore(int8, queries[:1], doc_groups[:1], per_query)
+
+    fp32_scores, fp32_time = _timed_rescore(fp32, queries, doc_groups, per_query)
+    int8_scores, int8_time = _timed_rescore(int8, queries, doc_groups, per_query)
+
+    diffs = torch.cat([(x - y).abs() for x, y in zip(fp32_scores, int8_scores)])
+    spearman = [_spearman(x, y) for x, y in zip(fp32_scores, int8_scores) if x.numel() > 1]
+    top1 = [x.argmax().item() == y.argmax().item() for x, y in zip(fp32_scores, int8_scores)]
+
+    return {
+        'scored_with': 'Searcher.rescore' if per_query else 'Searcher.rescore_batch',
+        'num_queries': len(queries),
+        'num_documents': diffs.numel(),
+        'max_abs_diff': diffs.max().item(),
+        'mean_abs_diff': diffs.mean().item(),
+        'mean_spearman': sum(spearman) / len(spearman) if spearman else 1.0,
+        'min_spearman': min(spearman) if spearman else 1.0,
+        'top1_agreement': sum(top1) / len(top1),
+        'fp32_seconds': fp32_time,
+        'int8_seconds': int8_time,
+        'speedup': fp32_time / int8_time,
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Compare int8 quantized and full precision ColBERT scores on a sample.')
+
+    parser.add_argument('--checkpoint', dest='checkpoint', required=True)
+    parser.add_argument('--queries', dest='queries', required=True)
+    parser.add_argument('--collection', dest='collection', required=True)
+    parser.add_argument('--num_queries', dest='num_queries', default=100, type=int)
+    parser.add_argument('--depth', dest='depth', default=32, type=int, help='passages scored per query')
+    parser.add_argument('--doc_maxlen', dest='doc_maxlen', default=180, type=int)
+    parser.add_argument('--query_maxlen', dest='query_maxlen', default=32, type=int)
+    parser.add_argument('--per_query', dest='per_query', default=False, action='store_true',
+                        help='score through Searcher.rescore, one query at a time, rather than rescore_batch')
+    parser.add_argument('--rng_seed', dest='rng_seed', default=12345, type=int)
+
+    args = parser.parse_args()
+
+    random.seed(args.rng_seed)
+
+    queries = list(Queries(path=args.queries).values())
+    queries = random.sample(queries, min(len(queries), args.num_queries))
+
+    collection = Collection(path=args.collection)
+    doc_groups = [[collection[pid] for pid in random.sample(range(len(collection)), min(len(collection), args.depth))]
+                  for _ in queries]
+
+    config = ColBERTConfig(doc_maxlen=args.doc_maxlen, query_maxlen=args.query_maxlen)
+    report = compare_quantized_scores(args.checkpoint, queries, doc_groups, config, args.per_query)
+
+    for key, value in report.items():
+        print_message(f"#> {key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
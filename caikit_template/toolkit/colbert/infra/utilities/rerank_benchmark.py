@@ -0,0 +1,325 @@
+"""
+    Reproducible rerank benchmark: times `Rerank.run` and `Searcher.rescore` over a grid of query counts,
+    documents per query, document lengths and torch thread counts, and writes the latency quantiles,
+    throughput and resident memory of every cell as JSON. `compare` diffs two such files and fails on regressions.
+
+    Without --checkpoint, a tiny random-weight BERT ColBERT checkpoint is built locally (no downloads), so
+    the numbers measure the pipeline around the encoder rather than the encoder itself. Pass a real
+    checkpoint to benchmark production-sized models.
+
+        python -m caikit_template.toolkit.colbert.infra.utilities.rerank_benchmark run --output new.json
+        python -m caikit_template.toolkit.colbert.infra.utilities.rerank_benchmark compare old.json new.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import string
+import platform
+import resource
+import itertools
+import tempfile
+
+import numpy as np
+import torch
+
+from argparse import ArgumentParser
+
+from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
+from caikit_template.toolkit.colbert.modeling.mapped_weights import MAPPED_WEIGHTS_NAME, save_mapped_weights
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+TARGETS = ['rerank', 'searcher']
+CELL_KEYS = ['target', 'threads', 'num_queries', 'docs_per_query', 'doc_length']
+
+_CONSONANTS = 'bdfgklmnprstvz'
+_VOWELS = 'aeiou'
+
+
+def _synthetic_words(num_words):
+    syllables = [c + v for c in _CONSONANTS for v in _VOWELS]
+    return [a + b for a, b in itertools.product(syllables, repeat=2)][:num_words]
+
+
+def build_tiny_checkpoint(path, dim=32, hidden_size=64, num_layers=2, num_heads=2, num_words=2000, seed=12345):
+    """
+        Writes a random-weight BERT ColBERT checkpoint to `path`, in the memory-mapped format of `save_mapped`.
+
+        The vocabulary follows the BERT layout the tokenizers rely on ([unused0] = 1, [unused1] = 2,
+        [MASK] = 103), followed by the punctuation of the skiplist and `num_words` synthetic words, each of
+        which is a single token. Returns the synthetic words, to build texts with.
+    """
+
+    from transformers import BertConfig, BertTokenizerFast
+    from caikit_template.toolkit.colbert.modeling.hf_colbert import HF_ColBERT
+
+    os.makedirs(path, exist_ok=True)
+
+    words = _synthetic_words(num_words)
+    vocab = ['[PAD]'] + [f'[unused{idx}]' for idx in range(99)] + ['[UNK]', '[CLS]', '[SEP]', '[MASK]']
+    vocab += list(string.punctuation) + words
+
+    vocab_path = os.path.join(path, 'vocab.txt')
+    with open(vocab_path, 'w') as f:
+        f.write('\n'.join(vocab) + '\n')
+
+    BertTokenizerFast(vocab_file=vocab_path, do_lower_case=True).save_pretrained(path)
+
+    torch.manual_seed(seed)
+
+    colbert_config = ColBERTConfig(model_type='bert-base-uncased', dim=dim)
+    config = BertConfig(vocab_size=len(vocab), hidden_size=hidden_size, num_hidden_layers=num_layers,
+                        num_attention_heads=num_heads, intermediate_size=4 * hidden_size)
+
+    model = HF_ColBERT(config, colbert_config)
+
+    # factory.py matches the directory's config.json against the model type
+    model.config.name_or_path = colbert_config.model_type
+    model.config.save_pretrained(path)
+
+    save_mapped_weights(model.state_dict(), os.path.join(path, MAPPED_WEIGHTS_NAME))
+    colbert_config.save_for_checkpoint(path)
+
+    print_message(f"#> Built a tiny random checkpoint at {path}")
+
+    return words
+
+
+def _synthetic_texts(rng, words, num_texts, length):
+    return [' '.join(rng.choices(words, k=length)) for _ in range(num_texts)]
+
+
+def _rss_mb():
+    # the current resident set size; ru_maxrss would be the peak of the whole process, earlier cells included
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return None
+
+    return resident_pages * resource.getpagesize() / 1024 ** 2
+
+
+def _reset_peak_rss():
+    # "5" resets the peak resident set size (VmHWM) to the current one, so that each cell gets its own peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    # the peak resident set size since the last `_reset_peak_rss`
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return None
+
+
+def _rerank_call(rerank, queries, doc_groups):
+    from caikit_template.data_model.document_rerank import (SentenceRerankDict, SentenceRerankDocument,
+                                                            SentenceRerankDocuments, SentenceRerankDocumentsList)
+
+    documents = SentenceRerankDocumentsList([
+        SentenceRerankDocuments([SentenceRerankDocument(SentenceRerankDict(text, '', str(idx)), 0.0)
+                                 for idx, text in enumerate(texts)])
+        for texts in doc_groups
+    ])
+
+    return lambda: rerank.run(queries, documents, max_num_documents=-1)
+
+
+def _searcher_call(searcher, queries, doc_groups):
+    return lambda: [searcher.rescore(query, texts) for query, texts in zip(queries, doc_groups)]
+
+
+def benchmark_cell(call_factory, rng, words, num_queries, docs_per_query, doc_length, repeats, warmup):
+    """
+        Times `repeats` calls, each on freshly generated texts (so that no cache is ever hit), after `warmup`
+        untimed ones. Returns the latency quantiles in ms, the documents scored per second, and the resident
+        memory in MiB after the cell, its growth over the cell and its peak during the cell (None where /proc
+        is not available).
+    """
+
+    latencies = []
+    rss_before = _rss_mb()
+    _reset_peak_rss()
+
+    for iteration in range(warmup + repeats):
+        queries = _synthetic_texts(rng, words, num_queries, 8)
+        doc_groups = [_synthetic_texts(rng, words, docs_per_query, doc_length) for _ in range(num_queries)]
+        call = call_factory(queries, doc_groups)
+
+        start = time.perf_counter()
+        call()
+        elapsed = time.perf_counter() - start
+
+        if iteration >= warmup:
+            latencies.append(elapsed)
+
+    latencies_ms = np.array(latencies) * 1000
+    rss_after = _rss_mb()
+    peak_rss = _peak_rss_mb()
+
+    return {
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'mean_ms': float(latencies_ms.mean()),
+        'docs_per_sec': num_queries * docs_per_query * len(latencies) / sum(latencies),
+        'rss_mb': rss_after,
+        'rss_delta_mb': rss_after - rss_before if rss_after is not None else None,
+        'peak_rss_mb': peak_rss,
+    }
+
+
+def run_benchmark(checkpoint=None, targets=TARGETS, threads=(1,), num_queries=(1, 8), docs_per_query=(10, 100),
+                  doc_lengths=(32, 128), repeats=20, warmup=3, seed=12345):
+    """
+        Benchmarks every cell of the grid and returns the report (metadata and one result per cell).
+        Builds a tiny random checkpoint in a temporary directory when `checkpoint` is None.
+    """
+
+    from caikit_template.modules.reranker import Rerank
+
+    tmpdir = None
+    if checkpoint is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        checkpoint = tmpdir.name
+        words = build_tiny_checkpoint(checkpoint, seed=seed)
+    else:
+        words = _synthetic_words(2000)
+
+    # room for the longest documents plus the [CLS] [D] ... [SEP] markers
+    doc_maxlen = max(doc_lengths) + 3
+    rerank = Rerank.bootstrap(checkpoint, doc_maxlen=doc_maxlen)
+
+    call_factories = {
+        'rerank': lambda queries, doc_groups: _rerank_call(rerank, queries, doc_groups),
+        'searcher': lambda queries, doc_groups: _searcher_call(rerank.model, queries, doc_groups),
+    }
+
+    results = []
+    for num_threads, target, nq, ndocs, length in itertools.product(threads, targets, num_queries, docs_per_query, doc_lengths):
+        torch.set_num_threads(num_threads)
+        rng = random.Random(seed)
+
+        cell = {'target': target, 'threads': num_threads, 'num_queries': nq, 'docs_per_query': ndocs, 'doc_length': length}
+        cell.update(benchmark_cell(call_factories[target], rng, words, nq, ndocs, length, repeats, warmup))
+        results.append(cell)
+
+        print_message(f"#> {target} threads={num_threads} queries={nq} docs={ndocs} length={length}: "
+                      f"p50={cell['p50_ms']:.2f}ms p99={cell['p99_ms']:.2f}ms {cell['docs_per_sec']:.0f} docs/s")
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+    metadata = {
+        'checkpoint': 'tiny-random' if tmpdir is not None else checkpoint,
+        'doc_maxlen': doc_maxlen,
+        'repeats': repeats,
+        'warmup': warmup,
+        'seed': seed,
+        'torch': torch.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+    return {'metadata': metadata, 'results': results}
+
+
+def compare_reports(baseline, candidate, threshold=0.10, memory_threshold=0.10):
+    """
+        Matches the cells of two reports and returns, per cell, the relative change of every latency
+        quantile, of the throughput and of the peak resident memory. A cell regressed if a quantile grew,
+        or the throughput dropped, by more than `threshold`, or if its peak memory grew by more than
+        `memory_threshold`. Peak memory is compared only where both reports measured it.
+    """
+
+    def key(cell):
+        return tuple(cell[name] for name in CELL_KEYS)
+
+    baseline_cells = {key(cell): cell for cell in baseline['results']}
+
+    rows = []
+    for cell in candidate['results']:
+        before = baseline_cells.get(key(cell))
+        if before is None:
+            continue
+
+        changes = {metric: cell[metric] / before[metric] - 1 for metric in ['p50_ms', 'p95_ms', 'p99_ms', 'docs_per_sec']}
+        regressed = (any(changes[metric] > threshold for metric in ['p50_ms', 'p95_ms', 'p99_ms'])
+                     or changes['docs_per_sec'] < -threshold)
+
+        if cell.get('peak_rss_mb') is not None and before.get('peak_rss_mb') is not None:
+            changes['peak_rss_mb'] = cell['peak_rss_mb'] / before['peak_rss_mb'] - 1
+            regressed = regressed or changes['peak_rss_mb'] > memory_threshold
+
+        rows.append({**{name: cell[name] for name in CELL_KEYS}, 'changes': changes, 'regressed': regressed})
+
+    return rows
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark reranking, or compare two benchmark reports.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='run the benchmark grid and write a JSON report')
+    run.add_argument('--output', dest='output', required=True)
+    run.add_argument('--checkpoint', dest='checkpoint', default=None, help='a tiny random checkpoint is built if omitted')
+    run.add_argument('--targets', dest='targets', default=TARGETS, choices=TARGETS, nargs='+')
+    run.add_argument('--threads', dest='threads', default=[1], type=int, nargs='+')
+    run.add_argument('--num_queries', dest='num_queries', default=[1, 8], type=int, nargs='+')
+    run.add_argument('--docs_per_query', dest='docs_per_query', default=[10, 100], type=int, nargs='+')
+    run.add_argument('--doc_length', dest='doc_lengths', default=[32, 128], type=int, nargs='+', help='words (one token each) per document')
+    run.add_argument('--repeats', dest='repeats', default=20, type=int)
+    run.add_argument('--warmup', dest='warmup', default=3, type=int)
+    run.add_argument('--rng_seed', dest='rng_seed', default=12345, type=int)
+
+    compare = subparsers.add_parser('compare', help='diff two JSON reports; exits with 1 on a regression')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', dest='threshold', default=0.10, type=float, help='tolerated relative slowdown')
+    compare.add_argument('--memory_threshold', dest='memory_threshold', default=0.10, type=float,
+                         help='tolerated relative growth of the peak resident memory')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run_benchmark(args.checkpoint, args.targets, args.threads, args.num_queries, args.docs_per_query,
+                               args.doc_lengths, args.repeats, args.warmup, args.rng_seed)
+
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+        print_message(f"#> Wrote {len(report['results'])} results to {args.output}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows = compare_reports(baseline, candidate, args.threshold, args.memory_threshold)
+
+    for row in rows:
+        changes = ' '.join(f"{metric}={change:+.1%}" for metric, change in row['changes'].items())
+        cell = ' '.join(f"{name}={row[name]}" for name in CELL_KEYS)
+        print(f"{'REGRESSION' if row['regressed'] else 'ok':10} {cell} {changes}")
+
+    if any(row['regressed'] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
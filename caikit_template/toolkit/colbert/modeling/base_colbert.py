@@ -1,14 +1,23 @@
 import os
 import torch
+import dataclasses
 
 from transformers import AutoTokenizer
 
 from caikit_template.toolkit.colbert.utils.utils import torch_load_dnn
 from caikit_template.toolkit.colbert.utils.utils import print_message
 from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
+from caikit_template.toolkit.colbert.infra.config.settings import SearchSettings
 
 from caikit_template.toolkit.colbert.modeling.factory import get_colbert_from_pretrained
 from caikit_template.toolkit.colbert.modeling.factory import get_query_tokenizer, get_doc_tokenizer
+from caikit_template.toolkit.colbert.modeling.mapped_weights import MAPPED_WEIGHTS_NAME, save_mapped_weights
+
+# how a model is served rather than what it is: not saved with its weights, so that a saved model loads back plain
+SERVING_SETTINGS = [field.name for field in dataclasses.fields(SearchSettings)] + [
+    'doc_prune_k', 'doc_prune_policy', 'doc_prune_idf_path', 'doc_prune_stopwords_path', 'doc_packed_encoder',
+]
+
 
 class BaseColBERT(torch.nn.Module):
     """
@@ -60,6 +69,44 @@ class BaseColBERT(torch.nn.Module):
         self.model.save_pretrained(path)
         self.raw_tokenizer.save_pretrained(path)
 
-        self.colbert_config.save_for_checkpoint(path)
+        self.checkpoint_config().save_for_checkpoint(path)
+
+    def save_mapped(self, path):
+        """
+            Like `save`, but the weights go to a single memory-mappable safetensors file, which
+            `from_pretrained` maps back without unpickling or copying.
+        """
+        assert not path.endswith('.dnn'), f"{path}: We reserve *.dnn names for the deprecated checkpoint format."
+
+        # the packed params of dynamically quantized layers are not tensors safetensors can write, and an
+        # ONNX-served model would silently lose its graph: both must be saved from the fp32 checkpoint
+        quantized = any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in self.model.modules())
+        assert not quantized, f"{path}: Cannot save an int8 quantized model, save the checkpoint it was loaded from."
+        assert getattr(self, 'onnx_encoder', None) is None, \
+            f"{path}: Cannot save a model served from an ONNX encoder, save the checkpoint it was loaded from."
+
+        os.makedirs(path, exist_ok=True)
+
+        # factory.py matches the directory's config.json against the model type
+        self.model.config.name_or_path = self.colbert_config.model_type
+        self.model.config.save_pretrained(path)
+
+        save_mapped_weights(self.model.state_dict(), os.path.join(path, MAPPED_WEIGHTS_NAME))
+        self.raw_tokenizer.save_pretrained(path)
+
+        self.checkpoint_config().save_for_checkpoint(path)
+
+    def checkpoint_config(self):
+        """
+            The config saved with the weights: that of this model, with its `SERVING_SETTINGS` (caches, cascade,
+            precision, quantization, ONNX, truncation, packing, pruning...) back to their defaults.
+        """
+        config = ColBERTConfig.from_existing(self.colbert_config)
+        defaults = ColBERTConfig()
+
+        for name in SERVING_SETTINGS:
+            config.set(name, getattr(defaults, name))
+
+        return config
 
 
@@ -6,10 +6,16 @@ from caikit_template.toolkit.colbert.modeling.tokenization import QueryTokenizer
 from caikit_template.toolkit.colbert.utils.amp import MixedPrecisionManager
 
 from caikit_template.toolkit.colbert.modeling.colbert import ColBERT
-from caikit_template.toolkit.colbert.utils.utils import torch_load_dnn
+from caikit_template.toolkit.colbert.utils.utils import torch_load_dnn, shared_dnn_loads
 from caikit_template.toolkit.colbert.modeling.factory import get_query_tokenizer, get_doc_tokenizer
+from caikit_template.toolkit.colbert.modeling.onnx_encoder import OnnxEncoder
 from caikit_template.toolkit.colbert.utils.utils import print_message
 
+
+# encoded with both encoders when an ONNX graph is loaded, to catch a graph exported from another checkpoint
+ONNX_PROBE_TEXTS = ["what is late interaction retrieval?",
+                    "ColBERT encodes queries and passages into token embeddings, scored with MaxSim."]
+
 class Checkpoint(ColBERT):
     """
         Easy inference with ColBERT.
@@ -19,30 +25,119 @@ class Checkpoint(ColBERT):
 
     def __init__(self, name, colbert_config=None):
 
-        super().__init__(name, colbert_config)
-        assert self.training is False
+        # the config, model and model type below all come from a single deserialization of the checkpoint
+        with shared_dnn_loads():
+            super().__init__(name, colbert_config)
+            assert self.training is False
 
-        # get model type from checkpoint
-        if name.endswith('.dnn') or name.endswith('.model'):
-            dnn_checkpoint = torch_load_dnn(colbert_config.checkpoint)
-            model_type = dnn_checkpoint['model_type']
-        else:
-            model_type=name
+            # get model type from checkpoint
+            if name.endswith('.dnn') or name.endswith('.model'):
+                dnn_checkpoint = torch_load_dnn(colbert_config.checkpoint)
+                model_type = dnn_checkpoint['model_type']
+            else:
+                model_type=name
+
+        if self.colbert_config.quantize_int8:
+            self.quantize_int8()
 
         self.query_tokenizer = get_query_tokenizer(model_type, colbert_config.query_maxlen, colbert_config.attend_to_mask_tokens)
         self.doc_tokenizer = get_doc_tokenizer(model_type, colbert_config.doc_maxlen)
 
-        self.amp_manager = MixedPrecisionManager(True)
+        self.amp_manager = MixedPrecisionManager.from_precision(self.colbert_config.inference_precision)
+
+        self.onnx_encoder = None
+        if self.colbert_config.onnx_encoder_path:
+            self.use_onnx_encoder(self.colbert_config.onnx_encoder_path)
 
         self.docFromText_used = False
 
+    def quantize_int8(self):
+        """
+            Swaps the linear layers of the encoder and the ColBERT projection for int8 dynamically
+            quantized ones: weights are stored in int8 and activations are quantized on the fly.
+            The quantized kernels only run on CPU, so this is a no-op when a GPU is available.
+        """
+
+        if torch.cuda.is_available():
+            print_message("[WARNING] int8 quantization is CPU-only, keeping the full precision encoder.")
+            return
+
+        torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    def use_onnx_encoder(self, path):
+        """
+            Runs the encoder and projection from an ONNX graph exported with `export_onnx_encoder`.
+            ONNX Runtime serves the graph on CPU, so this is a no-op when a GPU is available.
+
+            The graph runs as exported, in fp32 and at full depth: the settings that change how the eager
+            encoder runs are rejected. Its embeddings of a probe text are checked against the eager ones.
+        """
+
+        if torch.cuda.is_available():
+            print_message("[WARNING] The ONNX encoder is CPU-only, keeping the eager encoder.")
+            return
+
+        config = self.colbert_config
+        incompatible = [name for name, value in [('doc_packed_encoder', config.doc_packed_encoder),
+                                                 ('encoder_layers', config.encoder_layers),
+                                                 ('quantize_int8', config.quantize_int8)] if value]
+        if config.inference_precision not in [None, 'fp32']:
+            incompatible.append(f"inference_precision={config.inference_precision}")
+
+        assert not incompatible, f"{path}: The ONNX encoder cannot be combined with {', '.join(incompatible)}."
+
+        self.onnx_encoder = OnnxEncoder(path)
+        self.check_onnx_parity(config.onnx_parity_tolerance)
+
+    def check_onnx_parity(self, tolerance):
+        """
+            Encodes `ONNX_PROBE_TEXTS` as queries and as documents with the eager and the ONNX encoder, and
+            raises if their embeddings differ by more than `tolerance`.
+        """
+
+        onnx_encoder = self.onnx_encoder
+
+        for tokenizer, encode in [(self.query_tokenizer, self.query), (self.doc_tokenizer, self.doc)]:
+            input_ids, attention_mask = tokenizer.tensorize(ONNX_PROBE_TEXTS)
+
+            self.onnx_encoder = None
+            eager = encode(input_ids, attention_mask)
+
+            self.onnx_encoder = onnx_encoder
+            exported = encode(input_ids, attention_mask)
+
+            diff = (eager.float() - exported.float()).abs().max().item()
+            assert diff <= tolerance, \
+                f"{onnx_encoder.path}: ONNX embeddings differ from the eager ones by {diff} > {tolerance}, " \
+                f"was the graph exported from this checkpoint?"
+
+    def _onnx_query(self, input_ids, attention_mask):
+        Q = self.onnx_encoder(input_ids, attention_mask)
+        Q, _ = self.mask_and_normalize(input_ids, Q, skiplist=[])
+
+        return Q
+
+    def _onnx_doc(self, input_ids, attention_mask, keep_dims=True):
+        assert keep_dims in [True, False, 'return_mask']
+
+        D = self.onnx_encoder(input_ids, attention_mask)
+        D, mask = self.mask_and_normalize(input_ids, D, skiplist=self.skiplist, prune=True)
+
+        return self.doc_output(D, mask, keep_dims)
+
     def query(self, *args, to_cpu=False, **kw_args):
+        if self.onnx_encoder is not None:
+            return self._onnx_query(*args, **kw_args)
+
         with torch.no_grad():
             with self.amp_manager.context():
                 Q = super().query(*args, **kw_args)
                 return Q.cpu() if to_cpu else Q
 
     def doc(self, *args, to_cpu=False, **kw_args):
+        if self.onnx_encoder is not None:
+            return self._onnx_doc(*args, **kw_args)
+
         with torch.no_grad():
             with self.amp_manager.context():
                 D = super().doc(*args, **kw_args)
@@ -95,7 +190,8 @@ class Checkpoint(ColBERT):
                     D.append(D_)
                     mask.append(mask_)
 
-                D, mask = torch.cat(D)[reverse_indices], torch.cat(mask)[reverse_indices]
+                # pruned batches may be narrower than the tokenizer's padding
+                D, mask = _stack_3D_tensors(D)[reverse_indices], _stack_3D_tensors(mask)[reverse_indices]
 
                 doclens = mask.squeeze(-1).sum(-1).tolist()
 
@@ -2,6 +2,8 @@ from caikit_template.toolkit.colbert.infra.config.config import ColBERTConfig
 from caikit_template.toolkit.colbert.search.strided_tensor import StridedTensor
 from caikit_template.toolkit.colbert.utils.utils import print_message, flatten, print_torch_extension_error_message
 from caikit_template.toolkit.colbert.modeling.base_colbert import BaseColBERT
+from caikit_template.toolkit.colbert.modeling.token_pruning import TokenPruner, compact_tokens
+from caikit_template.toolkit.colbert.modeling.sequence_packing import packed_encode
 from caikit_template.toolkit.colbert.parameters import DEVICE
 
 import torch
@@ -12,6 +14,7 @@ import numpy as np
 
 import os
 import pathlib
+from contextlib import contextmanager
 from torch.utils.cpp_extension import load
 import sys
 
@@ -33,6 +36,18 @@ class ColBERT(BaseColBERT):
             self.skiplist = {w: True
                              for symbol in string.punctuation
                              for w in [symbol, self.raw_tokenizer.encode(symbol, add_special_tokens=False)[0]]}
+
+            # the token ids of the skiplist, to mask them on device; moves along with the model
+            self.register_buffer('skiplist_ids', skiplist_token_ids(self.skiplist), persistent=False)
+
+        self.token_pruner = None
+        if self.colbert_config.doc_prune_k or self.colbert_config.doc_prune_policy == 'stopwords':
+            self.token_pruner = TokenPruner(self.colbert_config.doc_prune_k, self.colbert_config.doc_prune_policy,
+                                            self.raw_tokenizer, idf_path=self.colbert_config.doc_prune_idf_path,
+                                            stopwords_path=self.colbert_config.doc_prune_stopwords_path)
+        if self.colbert_config.encoder_layers:
+            self.use_encoder_layers(self.colbert_config.encoder_layers)
+
         self.query_used = False
         self.doc_used = False
 
@@ -65,6 +80,55 @@ class ColBERT(BaseColBERT):
 
         cls.loaded_extensions = True
 
+    def use_encoder_layers(self, num_layers):
+        """
+            Runs only the first `num_layers` layers of the encoder; the projection then applies to the hidden
+            states of the last one. The other layers are kept aside, so a later, larger `num_layers` restores them.
+            Saving always writes the full encoder.
+
+            Only applies to the eager fp32 encoder: the layers kept aside would not be quantized, and an
+            ONNX graph runs all the layers it was exported with.
+        """
+        assert getattr(self, 'onnx_encoder', None) is None, "encoder_layers cannot be changed with an ONNX encoder"
+        assert not any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in self.bert.modules()), \
+            "encoder_layers cannot be changed on an int8 quantized encoder"
+
+        if not hasattr(self, 'all_encoder_layers'):
+            self.all_encoder_layers = list(self.bert.encoder.layer)  # a plain list: not registered as submodules
+
+        assert 0 < num_layers <= len(self.all_encoder_layers), (num_layers, len(self.all_encoder_layers))
+
+        self.bert.encoder.layer = torch.nn.ModuleList(self.all_encoder_layers[:num_layers]).to(self.device)
+        self.bert.config.num_hidden_layers = num_layers
+
+        print_message(f"#> Running {num_layers} of {len(self.all_encoder_layers)} encoder layers")
+
+    @contextmanager
+    def full_encoder_depth(self):
+        """Runs (and saves) all the encoder layers within the block, then restores the current depth."""
+        num_layers = len(self.bert.encoder.layer)
+        all_layers = len(getattr(self, 'all_encoder_layers', self.bert.encoder.layer))
+
+        if num_layers == all_layers:
+            yield
+            return
+
+        self.bert.encoder.layer = torch.nn.ModuleList(self.all_encoder_layers).to(self.device)
+        self.bert.config.num_hidden_layers = all_layers
+        try:
+            yield
+        finally:
+            self.bert.encoder.layer = torch.nn.ModuleList(self.all_encoder_layers[:num_layers]).to(self.device)
+            self.bert.config.num_hidden_layers = num_layers
+
+    def save(self, path):
+        with self.full_encoder_depth():
+            super().save(path)
+
+    def save_mapped(self, path):
+        with self.full_encoder_depth():
+            super().save_mapped(path)
+
     def forward(self, Q, D):
         Q = self.query(*Q)
         D, D_mask = self.doc(*D, keep_dims='return_mask')
@@ -131,10 +195,9 @@ class ColBERT(BaseColBERT):
             print_message(f"#>>>>> Q: {Q[0].size()}, {Q[0]}")
 
 
-        mask = torch.tensor(self.mask(input_ids, skiplist=[]), device=self.device).unsqueeze(2).float()
-        Q = Q * mask
+        Q, _ = self.mask_and_normalize(input_ids, Q, skiplist=[])
 
-        return torch.nn.functional.normalize(Q, p=2, dim=2)
+        return Q
 
     def doc(self, input_ids, attention_mask, keep_dims=True):
         assert keep_dims in [True, False, 'return_mask']
@@ -146,7 +209,10 @@ class ColBERT(BaseColBERT):
             print_message("#>>>> colbert doc ==")
             print_message(f"#>>>>> input_ids: {input_ids[0].size()}, {input_ids[0]}")
 
-        D = self.bert(input_ids, attention_mask=attention_mask)[0]
+        if self.colbert_config.doc_packed_encoder:
+            D = packed_encode(self.bert, input_ids, attention_mask)
+        else:
+            D = self.bert(input_ids, attention_mask=attention_mask)[0]
 
         if not self.doc_used:
             print_message("#>>>> before linear doc ==")
@@ -164,12 +230,35 @@ class ColBERT(BaseColBERT):
             print_message(f"#>>>>> D: {D[0].size()}, {D[0]}")
 
 
-        mask = torch.tensor(self.mask(input_ids, skiplist=self.skiplist), device=self.device).unsqueeze(2).float()
-        D = D * mask
+        dtype = D.dtype
+        D, mask = self.mask_and_normalize(input_ids, D, skiplist=self.skiplist, prune=True)
+
+        return self.doc_output(D, mask, keep_dims, dtype=dtype)
+
+    def mask_and_normalize(self, input_ids, E, skiplist, prune=False):
+        """
+            Zeroes out the embeddings of padding and skiplist tokens, and of the tokens dropped by
+            the document token pruner when `prune` is set, and L2-normalizes the rest, in fp32.
+        """
+        mask = self.mask(input_ids, skiplist=skiplist).to(E.device).unsqueeze(2).float()
+
+        if prune and self.token_pruner is not None:
+            mask = self.token_pruner.prune(input_ids, E, mask)
+
+        E = E.float() * mask
+
+        return torch.nn.functional.normalize(E, p=2, dim=2), mask
+
+    def doc_output(self, D, mask, keep_dims, dtype=None):
+        if self.token_pruner is not None and keep_dims is not False:
+            # pruned documents: drop the pruned tokens from the padded output, mask included
+            D, mask = compact_tokens(D, mask)
 
-        D = torch.nn.functional.normalize(D, p=2, dim=2)
         if self.use_gpu:
             D = D.half()
+        elif dtype == torch.bfloat16:
+            # bf16 autocast on CPU: store the document embeddings in bf16, like fp16 on GPU
+            D = D.to(dtype)
 
         if keep_dims is False:
             D, mask = D.cpu(), mask.bool().cpu().squeeze(-1)
@@ -191,8 +280,20 @@ class ColBERT(BaseColBERT):
         return colbert_score(Q, D_padded, D_mask, config=self.colbert_config)
 
     def mask(self, input_ids, skiplist):
-        mask = [[(x not in skiplist) and (x != 0) for x in d] for d in input_ids.cpu().tolist()]
-        return mask
+        """Boolean mask of the tokens that are neither padding (id 0) nor in `skiplist`, on the device of `input_ids`."""
+        if len(skiplist) == 0:
+            return input_ids != 0
+
+        return skiplist_mask(input_ids, self.skiplist_ids if skiplist is self.skiplist else skiplist_token_ids(skiplist))
+
+
+def skiplist_token_ids(skiplist):
+    # a skiplist holds both the punctuation symbols and their token ids; only the ids can be matched
+    return torch.tensor(sorted(w for w in skiplist if isinstance(w, int)), dtype=torch.long)
+
+
+def skiplist_mask(input_ids, skiplist_ids):
+    return (input_ids != 0) & ~torch.isin(input_ids, skiplist_ids.to(input_ids.device))
 
 
 # TODO: In Query/DocTokenizer, use colbert.raw_tokenizer
@@ -203,20 +304,28 @@ def colbert_score_reduce(scores_padded, D_mask, config: ColBERTConfig):
     scores_padded[D_padding] = -9999
     scores = scores_padded.max(1).values
 
+    return colbert_interaction_reduce(scores, config)
+
+
+def colbert_interaction_reduce(scores, config: ColBERTConfig):
+    """
+        Reduces the MaxSim of every query token, `scores` = (*, query length), to one score per (query, passage).
+    """
+
     assert config.interaction in ['colbert', 'flipr'], config.interaction
 
     if config.interaction == 'flipr':
         assert config.query_maxlen == 64, ("for now", config)
-        # assert scores.size(1) == config.query_maxlen, scores.size()
+        # assert scores.size(-1) == config.query_maxlen, scores.size()
 
         K1 = config.query_maxlen // 2
         K2 = 8
 
-        A = scores[:, :config.query_maxlen].topk(K1, dim=-1).values.sum(-1)
+        A = scores[..., :config.query_maxlen].topk(K1, dim=-1).values.sum(-1)
         B = 0
 
-        if K2 <= scores.size(1) - config.query_maxlen:
-            B = scores[:, config.query_maxlen:].topk(K2, dim=-1).values.sum(1)
+        if K2 <= scores.size(-1) - config.query_maxlen:
+            B = scores[..., config.query_maxlen:].topk(K2, dim=-1).values.sum(-1)
 
         return A + B
 
@@ -243,12 +352,60 @@ def colbert_score(Q, D_padded, D_mask, config=ColBERTConfig()):
 
     scores = D_padded @ Q.to(dtype=D_padded.dtype).permute(0, 2, 1)
 
+    if scores.dtype == torch.bfloat16:
+        scores = scores.float()  # reduce bf16 similarities in fp32
+
     return colbert_score_reduce(scores, D_mask, config)
 
 
-def colbert_score_packed(Q, D_packed, D_lengths, config=ColBERTConfig()):
+def colbert_score_cross(Q, D_padded, D_mask, config=ColBERTConfig(), max_block_bytes=256 * 1024 ** 2):
+    """
+        Supply sizes Q = (num_queries, *, dim) and D = (num_docs, *, dim).
+        Compares every query matrix with every passage and returns a (num_queries, num_docs) score matrix.
+
+        Passages are scored in blocks, each with one matmul against all query tokens, so that the fp32
+        similarities of a block (num_queries x block x doc length x query length) stay within `max_block_bytes`.
+    """
+
+    use_gpu = torch.cuda.is_available()
+    if use_gpu:
+        Q, D_padded, D_mask = Q.cuda(), D_padded.cuda(), D_mask.cuda()
+
+    assert Q.dim() == 3, Q.size()
+    assert D_padded.dim() == 3, D_padded.size()
+
+    num_queries, query_len, dim = Q.size()
+    num_docs, doc_len, _ = D_padded.size()
+
+    D_padding = ~D_mask.view(num_docs, doc_len).bool()
+    Q = Q.to(dtype=D_padded.dtype).reshape(num_queries * query_len, dim).T
+
+    block = max(max_block_bytes // (4 * num_queries * query_len * doc_len), 1)
+
+    all_scores = []
+    for offset in range(0, num_docs, block):
+        D_block = D_padded[offset:offset+block]
+
+        scores = (D_block.reshape(-1, dim) @ Q).float()  # also reduces bf16 similarities in fp32
+        scores = scores.view(D_block.size(0), doc_len, num_queries, query_len)
+        scores[D_padding[offset:offset+block]] = -9999
+
+        # MaxSim over the passage tokens: (block, num_queries, query length)
+        scores = scores.max(1).values
+        all_scores.append(colbert_interaction_reduce(scores, config).T)
+
+    if not all_scores:
+        return torch.zeros(num_queries, 0, device=Q.device)
+
+    return torch.cat(all_scores, dim=1)
+
+
+def colbert_score_packed(Q, D_packed, D_lengths, config=ColBERTConfig(), exact_max=False):
     """
         Works with a single query only.
+
+        On CPU, the segmented MaxSim kernel starts every maximum at 0, as the index path always has. With
+        `exact_max` it takes the true maximum instead, as `colbert_score` and the GPU path do.
     """
     use_gpu = torch.cuda.is_available()
     if use_gpu:
@@ -261,9 +418,12 @@ def colbert_score_packed(Q, D_packed, D_lengths, config=ColBERTConfig()):
 
     scores = D_packed @ Q.to(dtype=D_packed.dtype).T
 
+    if scores.dtype == torch.bfloat16:
+        scores = scores.float()  # reduce bf16 similarities in fp32, as segmented_maxsim expects
+
     if use_gpu or config.interaction == "flipr":
         scores_padded, scores_mask = StridedTensor(scores, D_lengths, use_gpu=use_gpu).as_padded_tensor()
 
         return colbert_score_reduce(scores_padded, scores_mask, config)
     else:
-        return ColBERT.segmented_maxsim(scores, D_lengths)
+        return ColBERT.segmented_maxsim(scores, D_lengths, float('-inf') if exact_max else 0.0)
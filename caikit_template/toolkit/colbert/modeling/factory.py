@@ -65,6 +65,10 @@ def get_colbert_from_pretrained(name, colbert_config):
     colbert.model_type=model_type
     return colbert
 
+#----------------------------------------------------------------
+def _has_tokenizer_files(model_dir):
+    return model_dir is not None and os.path.exists(os.path.join(model_dir, 'tokenizer_config.json'))
+
 #----------------------------------------------------------------
 def get_query_tokenizer(model_type, maxlen, attend_to_mask_tokens):
     model_dir = None
@@ -80,14 +84,17 @@ def get_query_tokenizer(model_type, maxlen, attend_to_mask_tokens):
 
     print_message(f"get query model type: {model_type}")
 
+    # prefer the tokenizer files saved next to the model, if any
+    tokenizer_path = model_dir if _has_tokenizer_files(model_dir) else model_type
+
     if model_type=='bert-base-uncased' or model_type=='bert-large-uncased':
-        return QueryTokenizer(maxlen,model_type, attend_to_mask_tokens)
+        return QueryTokenizer(maxlen, tokenizer_path, attend_to_mask_tokens)
     elif model_type=='tinybert':
         return QueryTokenizer(maxlen, 'bert-base-uncased',attend_to_mask_tokens)
     elif model_type=='xlm-roberta-base' or model_type=='xlm-roberta-large':
-        return QueryTokenizerXLMR(maxlen, model_type)
+        return QueryTokenizerXLMR(maxlen, tokenizer_path)
     elif model_type=='roberta-base' or model_type=='roberta-large':
-        return QueryTokenizerRoberta(maxlen, model_type)
+        return QueryTokenizerRoberta(maxlen, tokenizer_path)
     else:
         raise NotImplementedError
 
@@ -107,13 +114,16 @@ def get_doc_tokenizer(model_type, maxlen):
 
     print_message(f"get doc model type: {model_type}")
 
+    # prefer the tokenizer files saved next to the model, if any
+    tokenizer_path = model_dir if _has_tokenizer_files(model_dir) else model_type
+
     if model_type=='bert-base-uncased' or model_type=='bert-large-uncased':
-        return DocTokenizer(maxlen, model_type)
+        return DocTokenizer(maxlen, tokenizer_path)
     elif model_type=='tinybert':
         return DocTokenizer(maxlen, 'bert-base-uncased')
     elif model_type=='xlm-roberta-base' or model_type=='xlm-roberta-large':
-        return DocTokenizerXLMR(maxlen, model_type)
+        return DocTokenizerXLMR(maxlen, tokenizer_path)
     elif model_type=='roberta-base' or model_type=='roberta-large':
-        return DocTokenizerRoberta(maxlen, model_type)
+        return DocTokenizerRoberta(maxlen, tokenizer_path)
     else:
         raise NotImplementedError
@@ -4,6 +4,7 @@ from transformers import BertPreTrainedModel, BertModel, AutoTokenizer
 
 from caikit_template.toolkit.colbert.utils.utils import torch_load_dnn
 from caikit_template.toolkit.colbert.utils.utils import print_message
+from caikit_template.toolkit.colbert.modeling.mapped_weights import has_mapped_weights, load_mapped_pretrained
 
 class HF_ColBERT(BertPreTrainedModel):
     """
@@ -50,6 +51,12 @@ class HF_ColBERT(BertPreTrainedModel):
 
             return obj
 
+        if has_mapped_weights(name_or_path):
+            obj = load_mapped_pretrained(cls, name_or_path, colbert_config)
+            obj.base = name_or_path
+
+            return obj
+
         obj = super().from_pretrained(name_or_path, colbert_config=colbert_config)
         obj.base = name_or_path
 
@@ -4,6 +4,7 @@ from transformers import AutoTokenizer, RobertaModel
 
 from caikit_template.toolkit.colbert.utils.utils import torch_load_dnn
 from caikit_template.toolkit.colbert.utils.utils import print_message
+from caikit_template.toolkit.colbert.modeling.mapped_weights import has_mapped_weights, load_mapped_pretrained
 
 class HF_ColBERT_Roberta(RobertaModel):
     """
@@ -49,6 +50,12 @@ class HF_ColBERT_Roberta(RobertaModel):
 
             return obj
 
+        if has_mapped_weights(name_or_path):
+            obj = load_mapped_pretrained(cls, name_or_path, colbert_config)
+            obj.base = name_or_path
+
+            return obj
+
         obj = super().from_pretrained(name_or_path, colbert_config=colbert_config)  # <<<< HERE
 
         obj.base = name_or_path
@@ -0,0 +1,102 @@
+"""
+    Memory-mappable weights: a single safetensors file whose tensors are mapped straight from the page cache.
+
+    Loading does not unpickle or copy anything; pages are only read when touched, and processes that map
+    the same file share one copy of the weights.
+"""
+
+import os
+import json
+import struct
+import torch
+
+from collections import OrderedDict
+from safetensors.torch import save_file
+from transformers import AutoConfig
+from transformers.modeling_utils import no_init_weights
+
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+MAPPED_WEIGHTS_NAME = 'model.safetensors'
+
+_DTYPES = {
+    'F64': torch.float64, 'F32': torch.float32, 'F16': torch.float16, 'BF16': torch.bfloat16,
+    'I64': torch.int64, 'I32': torch.int32, 'I16': torch.int16, 'I8': torch.int8,
+    'U8': torch.uint8, 'BOOL': torch.bool,
+}
+
+
+def has_mapped_weights(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MAPPED_WEIGHTS_NAME))
+
+
+def save_mapped_weights(state_dict, path):
+    # safetensors refuses aliased tensors (e.g., HF_ColBERT_XLMR registers its encoder as both `roberta` and `bert`)
+    tensors, seen = OrderedDict(), set()
+
+    for name, tensor in state_dict.items():
+        key = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.size()))
+
+        if key in seen:
+            continue
+
+        seen.add(key)
+        tensors[name] = tensor.detach().cpu().contiguous()
+
+    save_file(tensors, path, metadata={'format': 'pt'})
+
+
+def load_mapped_weights(path):
+    with open(path, 'rb') as f:
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len))
+
+    data_start = 8 + header_len
+
+    # A private (copy-on-write) mapping also works on read-only volumes; untouched pages stay shared
+    buffer = torch.from_file(path, shared=False, size=os.path.getsize(path), dtype=torch.uint8)
+
+    state_dict = OrderedDict()
+
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+
+        dtype = _DTYPES[info['dtype']]
+        begin, end = info['data_offsets']
+
+        tensor = buffer[data_start + begin : data_start + end]
+
+        if (data_start + begin) % torch.empty(0, dtype=dtype).element_size() != 0:
+            tensor = tensor.clone()  # misaligned for a zero-copy view
+
+        state_dict[name] = tensor.view(dtype).view(info['shape'])
+
+    return state_dict
+
+
+def load_mapped_pretrained(cls, path, colbert_config):
+    """
+        Builds an HF_ColBERT* model from `path` without initializing its weights, then assigns the mapped tensors.
+    """
+
+    config = AutoConfig.from_pretrained(path)
+
+    with no_init_weights():
+        obj = cls(config, colbert_config)
+
+    state_dict = load_mapped_weights(os.path.join(path, MAPPED_WEIGHTS_NAME))
+    missing, unexpected = obj.load_state_dict(state_dict, strict=False, assign=True)
+
+    # keys missing only because they alias an assigned module are fine
+    assigned = {tensor.data_ptr() for tensor in state_dict.values()}
+    current = obj.state_dict()
+    missing = [key for key in missing if current[key].data_ptr() not in assigned]
+
+    if missing or unexpected:
+        print_message(f"[WARNING] Mapped weights in {path}: missing {missing}, unexpected {unexpected}")
+
+    obj.eval()
+
+    return obj
@@ -0,0 +1,82 @@
+"""
+    Exported-graph encoder: the transformer encoder plus the ColBERT projection as a single ONNX graph,
+    run with ONNX Runtime instead of eager PyTorch.
+
+    Masking and normalization stay in `ColBERT.mask_and_normalize`, so the embeddings match the eager path.
+    Requires the optional `onnx` (export) and `onnxruntime` (inference) packages.
+"""
+
+import os
+import torch
+
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+ONNX_ENCODER_NAME = 'encoder.onnx'
+
+
+class _ProjectedEncoder(torch.nn.Module):
+    def __init__(self, colbert):
+        super().__init__()
+
+        self.bert = colbert.bert
+        self.linear = colbert.linear
+
+    def forward(self, input_ids, attention_mask):
+        return self.linear(self.bert(input_ids, attention_mask=attention_mask)[0])
+
+
+def export_onnx_encoder(colbert, path, opset_version=17):
+    """
+        Exports the encoder and projection of `colbert` (any HF_ColBERT* based model) to `path`,
+        with dynamic batch and sequence axes.
+    """
+
+    if os.path.isdir(path):
+        path = os.path.join(path, ONNX_ENCODER_NAME)
+
+    encoder = _ProjectedEncoder(colbert).cpu().eval()
+
+    input_ids = torch.ones(2, 8, dtype=torch.long)
+    attention_mask = torch.ones(2, 8, dtype=torch.long)
+
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in ['input_ids', 'attention_mask', 'embeddings']}
+
+    with torch.no_grad():
+        torch.onnx.export(encoder, (input_ids, attention_mask), path,
+                          input_names=['input_ids', 'attention_mask'], output_names=['embeddings'],
+                          dynamic_axes=dynamic_axes, opset_version=opset_version, do_constant_folding=True)
+
+    print_message(f"#> Exported the encoder to {path}")
+
+    return path
+
+
+class OnnxEncoder:
+    """
+        Runs an exported encoder on CPU. Calls take and return torch tensors, like the eager
+        `bert` + `linear` pair it replaces.
+    """
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime
+
+        if os.path.isdir(path):
+            path = os.path.join(path, ONNX_ENCODER_NAME)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, input_ids, attention_mask):
+        outputs = self.session.run(['embeddings'], {
+            'input_ids': input_ids.cpu().numpy(),
+            'attention_mask': attention_mask.cpu().numpy(),
+        })
+
+        return torch.from_numpy(outputs[0])
@@ -47,7 +47,8 @@ void* max(void* args) {
 }
 
 torch::Tensor segmented_maxsim(const torch::Tensor scores,
-                               const torch::Tensor lengths) {
+                               const torch::Tensor lengths,
+                               const float init) {
     auto lengths_a = lengths.data_ptr<int64_t>();
     auto scores_a = scores.data_ptr<float>();
     auto ndocs = lengths.size(0);
@@ -55,8 +56,9 @@ torch::Tensor segmented_maxsim(const torch::Tensor scores,
     auto nquery_vectors = scores.size(1);
     auto nthreads = at::get_num_threads();
 
+    // init = 0 clamps negative MaxSims to 0, -inf takes the true maximum
     torch::Tensor max_scores =
-        torch::zeros({ndocs, nquery_vectors}, scores.options());
+        torch::full({ndocs, nquery_vectors}, init, scores.options());
 
     int64_t offsets[ndocs + 1];
     offsets[0] = 0;
@@ -93,5 +95,6 @@ torch::Tensor segmented_maxsim(const torch::Tensor scores,
 }
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
-    m.def("segmented_maxsim_cpp", &segmented_maxsim, "Segmented MaxSim");
+    m.def("segmented_maxsim_cpp", &segmented_maxsim, "Segmented MaxSim",
+          py::arg("scores"), py::arg("lengths"), py::arg("init") = 0.0f);
 }
@@ -0,0 +1,69 @@
+import torch
+
+
+def pack_rows(lengths, capacity):
+    """
+        First-fit decreasing: assigns every sequence to a row of at most `capacity` tokens.
+        Returns the row and the start offset within that row of every sequence, and the number of rows.
+    """
+
+    rows, starts, used = [0] * len(lengths), [0] * len(lengths), []
+
+    for idx in sorted(range(len(lengths)), key=lambda idx: -lengths[idx]):
+        for row, row_used in enumerate(used):
+            if row_used + lengths[idx] <= capacity:
+                break
+        else:
+            row = len(used)
+            used.append(0)
+
+        rows[idx], starts[idx] = row, used[row]
+        used[row] += lengths[idx]
+
+    return rows, starts, len(used)
+
+
+def packed_encode(encoder, input_ids, attention_mask):
+    """
+        Runs `encoder` (a HF BERT or (XLM-)RoBERTa model) over the right-padded batch `input_ids` with
+        the sequences packed back to back into as few rows as possible, each row as wide as the longest
+        sequence. A block-diagonal attention mask keeps every sequence to itself and position ids restart
+        at every sequence, so each real token gets the embedding it would get in the padded batch.
+
+        The feed-forward layers only see the padding left at the end of the rows; attention still spans
+        the row width. Returns the (batch, width, hidden) output of the padded batch, with zeros at padding.
+    """
+
+    bsize, width = input_ids.size()
+    lengths = attention_mask.sum(-1)
+
+    rows, starts, num_rows = pack_rows(lengths.tolist(), width)
+    rows = torch.tensor(rows, device=input_ids.device)
+    starts = torch.tensor(starts, device=input_ids.device)
+
+    # (sequence, position) of every real token, and its (row, column) in the packed batch
+    seq, pos = attention_mask.bool().nonzero(as_tuple=True)
+    row, col = rows[seq], starts[seq] + pos
+
+    # RoBERTa numbers positions from padding_idx + 1, BERT from 0
+    position_offset = getattr(encoder.embeddings, 'padding_idx', -1) + 1
+    pad_token_id = encoder.config.pad_token_id or 0
+
+    packed_ids = torch.full((num_rows, width), pad_token_id, dtype=input_ids.dtype, device=input_ids.device)
+    position_ids = torch.full((num_rows, width), position_offset, dtype=torch.long, device=input_ids.device)
+    segments = torch.full((num_rows, width), -1, dtype=torch.long, device=input_ids.device)
+
+    packed_ids[row, col] = input_ids[seq, pos]
+    position_ids[row, col] = pos + position_offset
+    segments[row, col] = seq
+
+    # tokens only attend within their own sequence (padding attends to padding, and is discarded)
+    packed_mask = (segments.unsqueeze(2) == segments.unsqueeze(1)).long()
+
+    hidden = encoder(packed_ids, attention_mask=packed_mask, position_ids=position_ids,
+                     token_type_ids=torch.zeros_like(packed_ids))[0]
+
+    output = hidden.new_zeros(bsize, width, hidden.size(-1))
+    output[seq, pos] = hidden[row, col]
+
+    return output
@@ -0,0 +1,105 @@
+import torch
+
+from caikit_template.toolkit.colbert.utils.utils import print_message
+
+
+PRUNING_POLICIES = ['norm', 'idf', 'stopwords']
+
+DEFAULT_STOPWORDS = ['a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from', 'has', 'have', 'he',
+                     'her', 'his', 'if', 'in', 'into', 'is', 'it', 'its', 'of', 'on', 'or', 'she', 'so', 'such',
+                     'that', 'the', 'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was', 'were', 'will',
+                     'with', 'which', 'who', 'would']
+
+
+class TokenPruner:
+    """
+        Keeps at most `k` token embeddings per document, chosen by `policy`:
+            * 'norm': the largest projected embeddings, measured before normalization;
+            * 'idf': the rarest tokens, from a precomputed table of per token-id IDF (see `build_idf_table`);
+            * 'stopwords': drops stopword tokens (in addition to the punctuation skiplist), then keeps the first `k`.
+    """
+
+    def __init__(self, k, policy, raw_tokenizer, idf_path=None, stopwords_path=None):
+        assert policy in PRUNING_POLICIES, policy
+        assert k is None or k > 0, k
+
+        self.k = k
+        self.policy = policy
+
+        if policy == 'idf':
+            assert idf_path is not None, "The 'idf' pruning policy needs doc_prune_idf_path"
+            self.idf = torch.load(idf_path, map_location='cpu').float()
+
+        if policy == 'stopwords':
+            words = DEFAULT_STOPWORDS
+            if stopwords_path is not None:
+                with open(stopwords_path) as f:
+                    words = [line.strip() for line in f if line.strip()]
+
+            # only words that are a single token can be dropped token-wise
+            ids = [raw_tokenizer.encode(word, add_special_tokens=False) for word in words]
+            self.stopword_ids = torch.tensor(sorted({x[0] for x in ids if len(x) == 1}), dtype=torch.long)
+
+        print_message(f"#> Pruning documents to {k} tokens with the '{policy}' policy")
+
+    def prune(self, input_ids, D, mask):
+        """
+            Given the projected (unnormalized) embeddings `D` and the (batch, doclen, 1) float `mask` of
+            tokens kept so far, returns the mask of the tokens that survive pruning.
+        """
+
+        if self.policy == 'stopwords':
+            mask = mask * ~torch.isin(input_ids, self.stopword_ids.to(input_ids.device)).unsqueeze(-1)
+
+        if self.k is None or D.size(1) <= self.k:
+            return mask
+
+        if self.policy == 'norm':
+            scores = D.float().norm(dim=-1)
+        elif self.policy == 'idf':
+            scores = self.idf.to(input_ids.device)[input_ids]
+        else:
+            scores = -torch.arange(D.size(1), device=D.device, dtype=torch.float).expand(D.size(0), -1)
+
+        scores = scores.masked_fill(mask.squeeze(-1) == 0, float('-inf'))
+        top = scores.topk(self.k, dim=1).indices
+
+        keep = torch.zeros_like(mask.squeeze(-1))
+        keep.scatter_(1, top, 1)
+
+        return mask * keep.unsqueeze(-1)
+
+
+def compact_tokens(D, mask):
+    """
+        Moves the kept tokens (`mask` is (batch, doclen, 1)) of every document to the front, preserving their
+        order, and trims the width to the longest document, so pruned tokens cost nothing downstream.
+    """
+
+    order = mask.squeeze(-1).float().argsort(dim=1, descending=True, stable=True)
+    width = max(int(mask.sum(1).max().item()), 1)
+    order = order[:, :width]
+
+    D = D.gather(1, order.unsqueeze(-1).expand(-1, -1, D.size(-1)))
+    mask = mask.gather(1, order.unsqueeze(-1))
+
+    return D, mask
+
+
+def build_idf_table(texts, raw_tokenizer, path, bsize=10000):
+    """
+        Computes the per token-id IDF over `texts` (e.g., the collection to be indexed) and saves it for the
+        'idf' pruning policy. Tokens that never occur get the highest IDF.
+    """
+
+    texts = list(texts)
+    df = torch.zeros(len(raw_tokenizer))
+
+    for offset in range(0, len(texts), bsize):
+        for ids in raw_tokenizer(texts[offset:offset+bsize], add_special_tokens=False)['input_ids']:
+            df[list(set(ids))] += 1
+
+    idf = torch.log((len(texts) + 1) / (df + 1))
+    torch.save(idf, path)
+
+    return idf
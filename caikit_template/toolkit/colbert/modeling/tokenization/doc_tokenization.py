@@ -52,14 +52,14 @@ class DocTokenizer():
 
         return ids
 
-    def tensorize(self, batch_text, bsize=None):
+    def tensorize(self, batch_text, bsize=None, maxlen=None):
         assert type(batch_text) in [list, tuple], (type(batch_text))
 
         # add placehold for the [D] marker
         batch_text = ['. ' + x for x in batch_text]
 
         obj = self.tok(batch_text, padding='longest', truncation='longest_first',
-                       return_tensors='pt', max_length=self.doc_maxlen)
+                       return_tensors='pt', max_length=maxlen or self.doc_maxlen)
 
         ids, mask = obj['input_ids'], obj['attention_mask']
 
@@ -23,7 +23,7 @@ class DocTokenizerXLMR():
     def encode(self, batch_text, add_special_tokens=False):
         raise NotImplementedError()
 
-    def tensorize(self, batch_text, bsize=None):
+    def tensorize(self, batch_text, bsize=None, maxlen=None):
         assert type(batch_text) in [list, tuple], (type(batch_text))
 
         # add placehold for the [D] marker
@@ -33,7 +33,7 @@ class DocTokenizerXLMR():
         batch_text = ['$ ' + x for x in batch_text]
 
         obj = self.tok(batch_text, padding='longest', truncation='longest_first',
-                       return_tensors='pt', max_length=self.doc_maxlen)
+                       return_tensors='pt', max_length=maxlen or self.doc_maxlen)
 
         ids, mask = obj['input_ids'], obj['attention_mask']
 
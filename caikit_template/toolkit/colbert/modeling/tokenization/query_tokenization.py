@@ -68,7 +68,7 @@ class QueryTokenizer():
 
         # postprocess for the [Q] marker and the [MASK] augmentation
         ids[:, 1] = self.Q_marker_token_id
-        ids[ids == 0] = self.mask_token_id
+        ids.masked_fill_(ids == 0, self.mask_token_id)
 
         if context is not None:
             assert len(context) == len(batch_text), (len(context), len(batch_text))
@@ -83,7 +83,7 @@ class QueryTokenizer():
 
         # if self.config.attend_to_mask_tokens:
         if self.attend_to_mask_tokens:
-            mask[ids == self.mask_token_id] = 1
+            mask.masked_fill_(ids == self.mask_token_id, 1)
             assert mask.sum().item() == mask.size(0) * mask.size(1), mask
 
         if not self.used:
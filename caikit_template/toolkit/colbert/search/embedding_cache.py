@@ -0,0 +1,213 @@
+import time
+import hashlib
+import threading
+import torch
+
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def embedding_cache_key(*parts):
+    """
+        Content-addressed key: a digest over the string form of every part (e.g., checkpoint, maxlen, text).
+    """
+
+    digest = hashlib.sha1()
+
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x00')
+
+    return digest.hexdigest()
+
+
+class DocumentEmbeddingCache:
+    """
+        Bounded LRU cache of per-document embedding matrices, i.e. (doclen, dim) tensors holding only the
+        non-padding token embeddings of each document.
+
+        Entries are evicted least-recently-used first once their total size exceeds `max_bytes`.
+        Safe to share across the threads of the serving thread pool.
+    """
+
+    def __init__(self, max_bytes):
+        assert max_bytes > 0, max_bytes
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            D = self._entries.get(key)
+
+            if D is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return D
+
+    def put(self, key, D):
+        nbytes = D.numel() * D.element_size()
+
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+            self._entries[key] = D
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+class QueryEmbeddingCache:
+    """
+        LRU cache of query embedding matrices with an optional time-to-live (in seconds).
+
+        Lookups are single-flight: when several threads miss on the same key at once, only the first
+        one runs the encoder and the others wait for its result.
+    """
+
+    def __init__(self, max_entries, ttl=None):
+        assert max_entries > 0, max_entries
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._entries = OrderedDict()  # key -> (Q, insertion time)
+        self._inflight = {}            # key -> Future, for keys being encoded by some thread
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_encode(self, keys, encode_fn):
+        """
+            Returns the stacked embeddings for `keys`. `encode_fn(positions)` must encode the queries at
+            those positions of `keys` and is only called for misses that no other thread is encoding.
+        """
+
+        if len(keys) == 0:
+            return encode_fn([])
+
+        results = [None] * len(keys)
+        owned = OrderedDict()  # key -> (first position, Future), for the misses encoded by this thread
+        pending = {}           # position -> Future
+
+        with self._lock:
+            now = time.monotonic()
+
+            for idx, key in enumerate(keys):
+                entry = self._entries.get(key)
+
+                if entry is not None and (self.ttl is None or now - entry[1] <= self.ttl):
+                    self._entries.move_to_end(key)
+                    results[idx] = entry[0]
+                    self.hits += 1
+                    continue
+
+                if entry is not None:
+                    del self._entries[key]
+
+                if key in self._inflight:
+                    self.coalesced += 1
+                    pending[idx] = self._inflight[key]
+                    continue
+
+                if key not in owned:
+                    self.misses += 1
+                    owned[key] = (idx, Future())
+                    self._inflight[key] = owned[key][1]
+
+                pending[idx] = owned[key][1]
+
+        if owned:
+            try:
+                Q = encode_fn([idx for idx, _ in owned.values()])
+            except BaseException as e:
+                with self._lock:
+                    for key, (_, future) in owned.items():
+                        del self._inflight[key]
+                        future.set_exception(e)
+                raise
+
+            with self._lock:
+                now = time.monotonic()
+
+                for Q_idx, key in enumerate(owned):
+                    self._entries[key] = (Q[Q_idx].clone(), now)
+                    self._entries.move_to_end(key)
+                    del self._inflight[key]
+
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+            for Q_idx, (_, future) in enumerate(owned.values()):
+                future.set_result(Q[Q_idx])
+
+        for idx, future in pending.items():
+            results[idx] = future.result()
+
+        device = results[0].device
+        return torch.stack([Q.to(device) for Q in results])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                    'entries': len(self._entries), 'max_entries': self.max_entries, 'ttl': self.ttl}
+
+
+def pad_document_matrices(matrices):
+    """
+        Stack (doclen, dim) matrices into a zero-padded (num_docs, maxlen, dim) tensor and its attention mask.
+    """
+
+    doclens = [D.size(0) for D in matrices]
+    maxlen = max(doclens)
+
+    D_padded = torch.zeros(len(matrices), maxlen, matrices[0].size(-1),
+                           dtype=matrices[0].dtype, device=matrices[0].device)
+
+    for idx, D in enumerate(matrices):
+        D_padded[idx, :D.size(0)] = D
+
+    attention_mask = (torch.arange(maxlen).unsqueeze(0) < torch.tensor(doclens).unsqueeze(-1)).long()
+
+    return D_padded, attention_mask
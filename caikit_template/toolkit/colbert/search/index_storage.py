@@ -83,6 +83,33 @@ class IndexScorer(IndexLoader, CandidateGeneration):
     def lookup_pids(self, passage_ids, out_device='cuda', return_mask=False):
         return self.embeddings_strided.lookup_pids(passage_ids, out_device)
 
+    def decompress_pids(self, pids):
+        """
+            Returns the packed, decompressed embeddings of `pids` and their lengths.
+        """
+
+        if self.use_gpu:
+            return self.lookup_pids(pids)
+
+        pids = torch.as_tensor(pids, dtype=torch.int32)
+
+        D_packed = IndexScorer.decompress_residuals(
+                pids,
+                self.doclens,
+                self.embeddings_strided.codes_strided.offsets,
+                self.codec.bucket_weights,
+                self.codec.reversed_bit_map,
+                self.codec.decompression_lookup_table,
+                self.embeddings.residuals,
+                self.embeddings.codes,
+                self.codec.centroids,
+                self.codec.dim,
+                self.codec.nbits
+            )
+        D_packed = torch.nn.functional.normalize(D_packed.to(torch.float32), p=2, dim=-1)
+
+        return D_packed, self.doclens[pids.long()]
+
     def retrieve(self, config, Q):
         Q = Q[:, :config.query_maxlen]   # NOTE: Candidate generation uses only the query tokens
         embedding_ids, centroid_scores = self.generate_candidates(config, Q)
@@ -159,24 +186,7 @@ class IndexScorer(IndexLoader, CandidateGeneration):
                 )
 
         # Rank final list of docs using full approximate embeddings (including residuals)
-        if self.use_gpu:
-            D_packed, D_mask = self.lookup_pids(pids)
-        else:
-            D_packed = IndexScorer.decompress_residuals(
-                    pids,
-                    self.doclens,
-                    self.embeddings_strided.codes_strided.offsets,
-                    self.codec.bucket_weights,
-                    self.codec.reversed_bit_map,
-                    self.codec.decompression_lookup_table,
-                    self.embeddings.residuals,
-                    self.embeddings.codes,
-                    self.codec.centroids,
-                    self.codec.dim,
-                    self.codec.nbits
-                )
-            D_packed = torch.nn.functional.normalize(D_packed.to(torch.float32), p=2, dim=-1)
-            D_mask = self.doclens[pids.long()]
+        D_packed, D_mask = self.decompress_pids(pids)
 
         if Q.size(0) == 1:
             return colbert_score_packed(Q, D_packed, D_mask, config), pids
@@ -1,4 +1,5 @@
 import os
+import time
 import torch
 
 from tqdm import tqdm
@@ -7,13 +8,16 @@ from typing import Union, List, Dict
 
 from caikit_template.toolkit.colbert.data import Collection, Queries, Ranking
 
-from caikit_template.toolkit.colbert.modeling.checkpoint import Checkpoint
+from caikit_template.toolkit.colbert.modeling.checkpoint import Checkpoint, _stack_3D_tensors
 from caikit_template.toolkit.colbert.search.index_storage import IndexScorer
+from caikit_template.toolkit.colbert.search.embedding_cache import DocumentEmbeddingCache, QueryEmbeddingCache, embedding_cache_key, pad_document_matrices
 
+from caikit_template.toolkit.colbert.infra import telemetry
 from caikit_template.toolkit.colbert.infra.provenance import Provenance
 from caikit_template.toolkit.colbert.infra.run import Run
 from caikit_template.toolkit.colbert.infra.config import ColBERTConfig
 from caikit_template.toolkit.colbert.infra.launcher import print_memory_stats
+from caikit_template.toolkit.colbert.utils.utils import flatten, lengths2offsets, shared_dnn_loads
 
 TextQueries = Union[str, List[str], Dict[int, str], Queries]
 TextDocuments = List[str]
@@ -27,14 +31,19 @@ class Searcher:
 
         if self.rescore_only:
             self.checkpoint = checkpoint
-            self.checkpoint_config = ColBERTConfig.load_from_checkpoint(self.checkpoint)
-            self.config = ColBERTConfig.from_existing(self.checkpoint_config, None, initial_config)
 
-            self.checkpoint = Checkpoint(self.checkpoint, colbert_config=self.config)
+            with shared_dnn_loads():
+                self.checkpoint_config = ColBERTConfig.load_from_checkpoint(self.checkpoint)
+                self.config = ColBERTConfig.from_existing(self.checkpoint_config, None, initial_config)
+
+                self.checkpoint = Checkpoint(self.checkpoint, colbert_config=self.config)
+
             use_gpu = torch.cuda.is_available()
             if use_gpu:
                 self.checkpoint = self.checkpoint.cuda()
 
+            self.configure_caches()
+
             return
 
         if initial_config.index_location is not None:
@@ -53,50 +62,344 @@ class Searcher:
         self.index_config = ColBERTConfig.load_from_index(self.index)
 
         self.checkpoint = checkpoint or self.index_config.checkpoint
-        self.checkpoint_config = ColBERTConfig.load_from_checkpoint(self.checkpoint)
-        self.config = ColBERTConfig.from_existing(self.checkpoint_config, self.index_config, initial_config)
 
-        self.collection = None
-        self.configure(checkpoint=self.checkpoint, collection=self.collection)
+        with shared_dnn_loads():
+            self.checkpoint_config = ColBERTConfig.load_from_checkpoint(self.checkpoint)
+            self.config = ColBERTConfig.from_existing(self.checkpoint_config, self.index_config, initial_config)
+
+            self.collection = None
+            self.configure(checkpoint=self.checkpoint, collection=self.collection)
+
+            self.checkpoint = Checkpoint(self.checkpoint, colbert_config=self.config)
 
-        self.checkpoint = Checkpoint(self.checkpoint, colbert_config=self.config)
         use_gpu = torch.cuda.is_available()
         if use_gpu:
             self.checkpoint = self.checkpoint.cuda()
 
         self.ranker = IndexScorer(self.index, use_gpu)
 
+        self.configure_caches()
+
         print_memory_stats()
 
     def configure(self, **kw_args):
         self.config.configure(**kw_args)
 
+    def configure_caches(self):
+        self.doc_cache = None
+        self.query_cache = None
+
+        if self.config.doc_cache_max_bytes:
+            self.doc_cache = DocumentEmbeddingCache(self.config.doc_cache_max_bytes)
+
+        if self.config.query_cache_size:
+            self.query_cache = QueryEmbeddingCache(self.config.query_cache_size, ttl=self.config.query_cache_ttl)
+
     def encode(self, text: TextQueries):
         queries = text if isinstance(text, list) else [text]
+
+        if self.query_cache is not None:
+            keys = [embedding_cache_key(self.config.checkpoint, self.config.query_maxlen, query) for query in queries]
+
+            def encode_misses(positions):
+                telemetry.increment('query_cache_misses', len(positions))
+                return self._encode([queries[idx] for idx in positions])
+
+            Q = self.query_cache.get_or_encode(keys, encode_misses)
+            telemetry.increment('query_cache_lookups', len(keys))
+
+            return Q
+
+        return self._encode(queries)
+
+    def _encode(self, queries: List[str]):
+        # Checkpoint.queryFromText, with tokenization and encoding timed apart
         bsize = 128 if len(queries) > 128 else None
 
         self.checkpoint.query_tokenizer.query_maxlen = self.config.query_maxlen
-        Q = self.checkpoint.queryFromText(queries, bsize=bsize, to_cpu=True)
+        telemetry.observe_size('query_batch_size', len(queries))
+
+        if bsize:
+            with telemetry.timed('tokenization'):
+                batches = self.checkpoint.query_tokenizer.tensorize(queries, bsize=bsize)
+
+            with telemetry.timed('query_encoding'):
+                return torch.cat([self.checkpoint.query(input_ids, attention_mask, to_cpu=True) for input_ids, attention_mask in batches])
 
-        return Q
+        with telemetry.timed('tokenization'):
+            input_ids, attention_mask = self.checkpoint.query_tokenizer.tensorize(queries)
 
-    def encode_documents(self, docs: TextDocuments):
+        with telemetry.timed('query_encoding'):
+            return self.checkpoint.query(input_ids, attention_mask)
+
+    def encode_documents(self, docs: TextDocuments, bsize=None, maxlen=None):
+        """
+            `maxlen` overrides `doc_maxlen` for this call only, e.g. to encode truncated prefixes.
+        """
         self.checkpoint.doc_tokenizer.doc_maxlen = self.config.doc_maxlen
 
-        input_ids, attention_mask = self.checkpoint.doc_tokenizer.tensorize(docs)        # as in colbert/modeling/checkpoint.py:112
-        D = self.checkpoint.doc(input_ids, attention_mask, keep_dims=True, to_cpu=False) # colbert/modeling/checkpoint.py:113
+        if bsize:
+            # Length-sorted batches, each encoded at its own width, restored to the input order afterwards
+            with telemetry.timed('tokenization'):
+                text_batches, reverse_indices = self.checkpoint.doc_tokenizer.tensorize(docs, bsize=bsize, maxlen=maxlen)
+
+            D, attention_mask = [], []
+            for input_ids, attention_mask_ in text_batches:
+                width = attention_mask_.sum(-1).max().item()
+                input_ids, attention_mask_ = input_ids[:, :width], attention_mask_[:, :width]
+
+                D_, attention_mask_ = self._doc(input_ids, attention_mask_)
+                D.append(D_)
+                attention_mask.append(attention_mask_.unsqueeze(-1))
+
+            D = _stack_3D_tensors(D)
+            attention_mask = _stack_3D_tensors(attention_mask).squeeze(-1)
+
+            return D[reverse_indices.to(D.device)], attention_mask[reverse_indices]
+
+        with telemetry.timed('tokenization'):
+            input_ids, attention_mask = self.checkpoint.doc_tokenizer.tensorize(docs, maxlen=maxlen)    # as in colbert/modeling/checkpoint.py:112
+        D, attention_mask = self._doc(input_ids, attention_mask)                                        # colbert/modeling/checkpoint.py:113
 
         return D, attention_mask # .sum(1)   # mask contains doc lengths
 
-    def rescore(self, text_queries, text_documents):
-        from caikit_template.toolkit.colbert.modeling.colbert import colbert_score
+    def _doc(self, input_ids, attention_mask):
+        telemetry.observe_size('document_batch_size', input_ids.size(0))
+        telemetry.observe_size('document_batch_tokens', int(attention_mask.sum().item()))
+
+        with telemetry.timed('document_encoding'):
+            if self.checkpoint.token_pruner is None:
+                return self.checkpoint.doc(input_ids, attention_mask, keep_dims=True, to_cpu=False), attention_mask
+
+            # pruned documents come back compacted: score them against the mask of the tokens they kept
+            D, mask = self.checkpoint.doc(input_ids, attention_mask, keep_dims='return_mask', to_cpu=False)
+            return D, mask.squeeze(-1).long().cpu()
+
+    def encode_documents_cached(self, docs: TextDocuments, include_title=False, bsize=None, maxlen=None):
+        """
+            Like `encode_documents`, but looks every document up in the document embedding cache first.
+            Only the misses are tokenized and encoded; `include_title` only namespaces the cache keys.
+        """
+        if self.doc_cache is None:
+            return self.encode_documents(docs, bsize=bsize, maxlen=maxlen)
+
+        return pad_document_matrices(self._document_matrices(docs, include_title=include_title, bsize=bsize, maxlen=maxlen))
+
+    def encode_documents_packed(self, docs: TextDocuments, include_title=False, bsize=None, maxlen=None):
+        """
+            Like `encode_documents_cached`, but the embeddings of all documents come back to back, as a
+            (total number of tokens, dim) tensor with the (num_docs,) tensor of their lengths: no padding
+            is allocated across encoder batches, nor scored downstream.
+        """
+        matrices = self._document_matrices(docs, include_title=include_title, bsize=bsize, maxlen=maxlen)
+
+        return torch.cat(matrices), torch.tensor([D.size(0) for D in matrices])
+
+    def _document_matrices(self, docs: TextDocuments, include_title=False, bsize=None, maxlen=None):
+        """One (doclen, dim) matrix per document, from the document embedding cache when possible."""
+        if self.doc_cache is None:
+            return self._encode_matrices(docs, bsize=bsize, maxlen=maxlen)
+
+        keys = [embedding_cache_key(self.config.checkpoint, maxlen or self.config.doc_maxlen, include_title, doc) for doc in docs]
+        matrices = [self.doc_cache.get(key) for key in keys]
+
+        missing = [idx for idx, D in enumerate(matrices) if D is None]
+
+        telemetry.increment('document_cache_lookups', len(keys))
+        telemetry.increment('document_cache_misses', len(missing))
+
+        if missing:
+            encoded = self._encode_matrices([docs[idx] for idx in missing], bsize=bsize, maxlen=maxlen)
+
+            for idx, D in zip(missing, encoded):
+                matrices[idx] = D.clone()  # don't pin the whole batch in the cache
+                self.doc_cache.put(keys[idx], matrices[idx])
+
+        return matrices
+
+    def _encode_matrices(self, docs: TextDocuments, bsize=None, maxlen=None):
+        self.checkpoint.doc_tokenizer.doc_maxlen = self.config.doc_maxlen
 
+        with telemetry.timed('tokenization'):
+            if bsize:
+                text_batches, reverse_indices = self.checkpoint.doc_tokenizer.tensorize(docs, bsize=bsize, maxlen=maxlen)
+            else:
+                text_batches = [self.checkpoint.doc_tokenizer.tensorize(docs, maxlen=maxlen)]
+                reverse_indices = torch.arange(len(docs))
+
+        matrices = []
+        for input_ids, attention_mask in text_batches:
+            width = attention_mask.sum(-1).max().item()
+            D, mask = self._doc(input_ids[:, :width], attention_mask[:, :width])
+
+            # kept tokens always come first, whether masked by attention or compacted after pruning
+            matrices.extend(d[:doclen] for d, doclen in zip(D, mask.sum(-1).tolist()))
+
+        return [matrices[idx] for idx in reverse_indices.tolist()]
+
+    def rescore(self, text_queries, text_documents, include_title=False):
+        """
+            Rescore the documents against one query, or against every query of a list of several (as
+            `rescore_cross`, returning a (num_queries, num_docs) tensor of scores).
+        """
         Q = self.encode(text_queries)
-        D, attention_mask = self.encode_documents(text_documents)
 
-        scores = colbert_score(Q, D, attention_mask, self.config)
+        if Q.size(0) == 1:
+            return self._score_packed(Q, *self.encode_documents_packed(text_documents, include_title=include_title,
+                                                                       bsize=self.config.rescore_bsize))
+
+        return self._score_cross(Q, text_documents, include_title)
+
+    def rescore_cross(self, text_queries: List[str], text_documents: TextDocuments, include_title=False):
+        """
+            Rescore every query against every document of a shared pool, encoding each query and each
+            document once. Returns a (len(text_queries), len(text_documents)) tensor of scores.
+        """
+        Q = self.encode(list(text_queries))
+
+        return self._score_cross(Q, text_documents, include_title)
+
+    def _score_cross(self, Q, text_documents, include_title=False):
+        from caikit_template.toolkit.colbert.modeling.colbert import colbert_score_cross
+
+        D, attention_mask = self.encode_documents_cached(text_documents, include_title=include_title,
+                                                         bsize=self.config.rescore_bsize)
+
+        with telemetry.timed('scoring'):
+            scores = colbert_score_cross(Q, D, attention_mask, self.config)
         return scores
 
+    def rescore_batch(self, text_queries: List[str], text_document_groups: List[TextDocuments], include_title=False):
+        """
+            Rescore each query against its own group of documents.
+
+            All queries are encoded together and the documents of all groups share length-sorted
+            encoder batches. Each group is then scored against its query exactly as `rescore` would.
+            When all queries share one group of documents, it is encoded once, as by `rescore_cross`.
+            Returns one tensor of scores per group.
+        """
+        assert len(text_queries) == len(text_document_groups), (len(text_queries), len(text_document_groups))
+
+        Q = self.encode(list(text_queries))
+
+        if self._shared_group(text_document_groups):
+            return list(self._score_cross(Q, text_document_groups[0], include_title))
+
+        return self._score_groups(Q, text_document_groups, include_title)
+
+    @staticmethod
+    def _shared_group(text_document_groups):
+        first = list(text_document_groups[0]) if text_document_groups else []
+        return len(text_document_groups) > 1 and len(first) > 0 and all(list(group) == first for group in text_document_groups[1:])
+
+    def rescore_cascade(self, text_queries: List[str], text_document_groups: List[TextDocuments], keep, prefix_maxlen,
+                        include_title=False):
+        """
+            Two-stage `rescore_batch`: every document is first scored from its encoding truncated to
+            `prefix_maxlen` tokens, and only the top `keep` of each group are re-encoded at `doc_maxlen`
+            and rescored. Groups of at most `keep` documents skip the prescreen. Returns, per group, the
+            scores (full scores for the kept documents, prescreen scores for the others, which are on a
+            different scale and only order the others among themselves) and a boolean tensor marking
+            the kept documents.
+        """
+        assert len(text_queries) == len(text_document_groups), (len(text_queries), len(text_document_groups))
+
+        Q = self.encode(list(text_queries))
+
+        large = [idx for idx, group in enumerate(text_document_groups) if len(group) > keep]
+        prescreen = [torch.zeros(len(group)) for group in text_document_groups]
+
+        if large:
+            large_scores = self._score_groups(Q[large], [text_document_groups[idx] for idx in large], include_title,
+                                              maxlen=prefix_maxlen)
+            for idx, scores in zip(large, large_scores):
+                prescreen[idx] = scores
+
+        kept_groups = [scores.topk(min(keep, scores.numel())).indices.sort().values.tolist() for scores in prescreen]
+        kept_texts = [[group[idx] for idx in kept] for group, kept in zip(text_document_groups, kept_groups)]
+
+        full = self._score_groups(Q, kept_texts, include_title)
+
+        all_scores, all_kept = [], []
+        for scores, kept, kept_scores in zip(prescreen, kept_groups, full):
+            scores, mask = scores.cpu().float(), torch.zeros(scores.numel(), dtype=torch.bool)
+
+            scores[kept] = kept_scores.cpu().float()
+            mask[kept] = True
+
+            all_scores.append(scores)
+            all_kept.append(mask)
+
+        return all_scores, all_kept
+
+    def _score_groups(self, Q, text_document_groups, include_title=False, maxlen=None):
+        docs = flatten([list(group) for group in text_document_groups])
+        if len(docs) == 0:
+            return [torch.zeros(0) for _ in text_document_groups]
+
+        D_packed, doclens = self.encode_documents_packed(docs, include_title=include_title, bsize=self.config.rescore_bsize,
+                                                         maxlen=maxlen)
+        token_offsets = [0] + doclens.cumsum(0).tolist()
+
+        all_scores = []
+        for query_idx, (offset, endpos) in enumerate(lengths2offsets([len(group) for group in text_document_groups])):
+            if offset == endpos:
+                all_scores.append(torch.zeros(0))
+                continue
+
+            D_group = D_packed[token_offsets[offset]:token_offsets[endpos]]
+            all_scores.append(self._score_packed(Q[query_idx:query_idx+1], D_group, doclens[offset:endpos]))
+
+        return all_scores
+
+    def _score_packed(self, Q, D_packed, doclens):
+        """Scores one query against packed documents, with the segmented MaxSim kernel on CPU, exactly as
+        `colbert_score` scores them padded."""
+        from caikit_template.toolkit.colbert.modeling.colbert import colbert_score_packed
+
+        with telemetry.timed('scoring'):
+            return colbert_score_packed(Q, D_packed, doclens, self.config, exact_max=True)
+
+    def rescore_until(self, text_query: str, text_documents: TextDocuments, deadline: float, include_title=False):
+        """
+            Rescore one query against its documents, one encoder batch of `rescore_bsize` documents at a
+            time and in the given order, until `deadline` (a `time.monotonic()` value) has passed.
+            Returns the scores of the documents rescored so far, i.e. of a prefix of `text_documents`.
+        """
+        Q = self.encode(text_query)
+        bsize = self.config.rescore_bsize
+
+        all_scores = []
+        for offset in range(0, len(text_documents), bsize):
+            if time.monotonic() >= deadline:
+                break
+
+            D_packed, doclens = self.encode_documents_packed(text_documents[offset:offset+bsize], include_title=include_title)
+            all_scores.append(self._score_packed(Q, D_packed, doclens).cpu().float())
+
+        return torch.cat(all_scores) if all_scores else torch.zeros(0)
+
+    def rescore_pids(self, text_query: str, pids: List[int]):
+        """
+            Rescore one query against already-indexed passages, decompressing their stored embeddings
+            instead of re-encoding the passage text.
+        """
+        from caikit_template.toolkit.colbert.modeling.colbert import colbert_score_packed
+
+        assert not self.rescore_only,  f"It looks like the engine was initialized for rescoring only."
+
+        if len(pids) == 0:
+            return torch.zeros(0)
+
+        Q = self.encode(text_query)
+
+        with torch.inference_mode():
+            with telemetry.timed('decompression'):
+                D_packed, D_lengths = self.ranker.decompress_pids(pids)
+
+            with telemetry.timed('scoring'):
+                return colbert_score_packed(Q, D_packed, D_lengths, self.config, exact_max=True)
+
     def search(self, text: str, k=10):
         assert not self.rescore_only,  f"It looks like the engine was initialized for rescoring only."
         return self.dense_search(self.encode(text), k)
@@ -4,24 +4,47 @@ from contextlib import contextmanager
 from caikit_template.toolkit.colbert.utils.utils import NullContextManager
 
 
+AMP_DTYPES = {'fp32': None, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
 class MixedPrecisionManager():
-    def __init__(self, activated):
-        self.activated = activated
+    """
+        Autocast on the device the model runs on: fp16 by default on GPU, and bf16 when asked for (on GPU or CPU).
+        CPU autocast only supports bf16, so without it the CPU runs in fp32.
+    """
+
+    def __init__(self, activated, dtype=None):
+        self.device_type = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.dtype = dtype or (torch.float16 if self.device_type == 'cuda' else None)
+        self.activated = activated and self.dtype is not None
 
-        if self.activated:
+        if self.device_type == 'cpu' and self.dtype == torch.float16:
+            self.activated = False
+
+        self.scaler = None
+        if self.activated and self.dtype == torch.float16:
             self.scaler = torch.cuda.amp.GradScaler()
 
+    @classmethod
+    def from_precision(cls, precision):
+        """
+            `precision` is one of 'fp32', 'fp16' or 'bf16', or None for the device default.
+        """
+        assert precision in [None, *AMP_DTYPES], precision
+
+        return cls(precision != 'fp32', dtype=AMP_DTYPES.get(precision))
+
     def context(self):
-        return torch.cuda.amp.autocast() if self.activated else NullContextManager()
+        return torch.autocast(self.device_type, dtype=self.dtype) if self.activated else NullContextManager()
 
     def backward(self, loss):
-        if self.activated:
+        if self.scaler is not None:
             self.scaler.scale(loss).backward()
         else:
             loss.backward()
 
     def step(self, colbert, optimizer, scheduler=None):
-        if self.activated:
+        if self.scaler is not None:
             self.scaler.unscale_(optimizer)
             torch.nn.utils.clip_grad_norm_(colbert.parameters(), 2.0, error_if_nonfinite=False)
 
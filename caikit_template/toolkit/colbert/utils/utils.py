@@ -3,8 +3,10 @@ import tqdm
 import torch
 import datetime
 import itertools
+import threading
 
 from multiprocessing import Pool
+from contextlib import contextmanager
 from collections import OrderedDict, defaultdict
 
 
@@ -54,12 +56,46 @@ def file_tqdm(file):
         pbar.close()
 
 
+_loaded_dnns = threading.local()
+
+
+@contextmanager
+def shared_dnn_loads():
+    """
+        Within this context, torch_load_dnn deserializes each checkpoint file at most once and hands the same
+        object (state dict, model_type, arguments) to every caller. The objects are released on exit.
+        Their optimizer state is dropped right away: none of the model-building callers use it.
+    """
+
+    if getattr(_loaded_dnns, 'dnns', None) is not None:
+        yield  # nested: the outermost context owns the loaded checkpoints
+        return
+
+    _loaded_dnns.dnns = {}
+
+    try:
+        yield
+    finally:
+        _loaded_dnns.dnns = None
+
+
 def torch_load_dnn(path):
+    dnns = getattr(_loaded_dnns, 'dnns', None)
+
+    if dnns is not None and path in dnns:
+        return dnns[path]
+
     if path.startswith("http:") or path.startswith("https:"):
         dnn = torch.hub.load_state_dict_from_url(path, map_location='cpu')
     else:
         dnn = torch.load(path, map_location='cpu')
 
+    if dnns is not None:
+        if isinstance(dnn, dict):
+            dnn.pop('optimizer_state_dict', None)
+
+        dnns[path] = dnn
+
     return dnn
 
 # def save_checkpoint(path, epoch_idx, mb_idx, model, optimizer, amp, train_loss, arguments=None):